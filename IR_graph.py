@@ -4,46 +4,57 @@ from utils.graph_util import *
 
 from IR_nodes import *
 
-import logging
 
 
+# Used by graphs that are not given the RandomUtil of a translation
 random_util = RandomUtil(123)
 
-# For visual rendering
-node_count = 0
 '''
 ################################################
 	IR GRAPH
 ################################################
 '''
 
+'''
+	Generated names and node ids come from the graph's RandomUtil. Every graph of a translation shares the
+	translation's RandomUtil, so the names it generates depend only on its seed.
+	Node additions are reported to the translation's Tracer, if any.
+'''
 class IRGraph:
-	def __init__(self, root_node=None):
-	 
+	def __init__(self, root_node=None, random_util=random_util, tracer=None):
+
+		self.random_util = random_util
+		self.tracer = tracer
+
 		self.generated_name = random_util.generate_function_name()
 	 
 		self.root_node = root_node
   
 		self.pointer = None
+
+		# For execution graphs split out of another graph, the node they were split at (a linearized branch or an
+		# async node). Running off the end of the graph continues wherever running past that node would.
+		self.origin = None
+		# For the head graph of a lowered loop, the loop. Running off the end of the graph starts the next iteration.
+		self.loop_node = None
   
 	def add_node(self, graph_node):
 	 
-		global node_count
 		# Initialize root node
 		if self.root_node is None:
-			logging.debug(f"Initializing root node of graph with node {graph_node.name}")
 			graph_node.IR_graph = self
-			graph_node.id = node_count
-			node_count += 1
+			graph_node.id = self.random_util.generate_node_id()
+			if self.tracer is not None and self.tracer.active:
+				self.tracer.emit("init_root", self, graph_node)
 			self.root_node = graph_node
 			self.pointer = self.root_node
 			return
 
 		graph_node.IR_graph = self
-		graph_node.id = node_count
-		node_count += 1
+		graph_node.id = self.random_util.generate_node_id()
   
-		logging.debug(f"Adding node {graph_node.name} {graph_node.id} to parent node {self.pointer.name} {graph_node.id}")
+		if self.tracer is not None and self.tracer.active:
+			self.tracer.emit("add_node", graph_node, self.pointer)
 		self.pointer.add_child(graph_node)
 
 		self.pointer = graph_node
@@ -53,9 +64,12 @@ class IRGraph:
 		old_node.parent.remove_child(old_node)
 		old_node.parent.add_child(new_node)
   
-		# Replace old_node's children reference to old_node with new_node
+		# Move old_node's children under new_node
 		for child in old_node.children:
-			child.parent = new_node
+			new_node.add_child(child)
+		old_node.first_child = None
+		old_node.last_child = None
+		old_node.summary = None
    
 		del old_node
   
@@ -70,57 +84,72 @@ class IRGraph:
 		new_node.add_child(child_node)
 		
 		# Set the IRGraph and id for the new node
-		global node_count
 		new_node.IR_graph = self
-		new_node.id = node_count
-		node_count += 1
+		new_node.id = self.random_util.generate_node_id()
 
 
 	def remove_node(self, removed_node):
 		removed_node.parent.remove_child(removed_node)
 
 	def get_descendants(self, node):
-		children = []
-		self._get_descendants(node, children)
-		return children
-  
-	def _get_descendants(self, node, children):
-		if not node.children: return
-  	
-		for child in node.children:
-			children.append(child)
-			self._get_descendants(child)
-   
-	def get_leaf_nodes(self, node):
-		leaves = []
-		self._get_leaf_nodes(node, leaves)
-		return leaves
-
-	def _get_leaf_nodes(self, node, leaves):
-		if not node.children: 
-			leaves.append(node)
+		descendants = self.preorder(node)
+		# The first node in preorder is the node itself
+		next(descendants)
+		return list(descendants)
+
+	'''
+		Answered from the cached subtree summaries, so repeated queries on a subtree that did not change are O(1)
+	'''
+	def contains_async(self, node):
+		return node.subtree_summary().contains_async
+
+	'''
+		Iterative depth-first traversals. Visited nodes are tracked by identity, so each walk is linear in the
+		size of the subtree and does not recurse (deep scripts do not hit the recursion limit).
+		The walks follow the sibling links, so no list of children is built. A node's first child is read when the
+		walk descends into it, so passes may add children to the node that was just yielded (preorder) and they will
+		be visited. The next sibling of a node is read before the node is yielded, so passes may move the node.
+	'''
+	def preorder(self, node=None):
+		if node is None:
+			node = self.root_node
+		if node is None:
+			return
+
+		visited = {id(node)}
+		yield node
+		stack = [node.first_child]
+		while stack:
+			child = stack.pop()
+			if child is None:
+				continue
+			stack.append(child.next_sibling)
+
+			if id(child) in visited:
+				continue
+			visited.add(id(child))
+			yield child
+			stack.append(child.first_child)
+
+	def postorder(self, node=None):
+		if node is None:
+			node = self.root_node
+		if node is None:
 			return
-  	
-		for child in node.children:
-			self._get_leaf_nodes(child, leaves)
-	 
-	def preorder(self, node, visited=None):
-		if visited is None:
-			visited = []
-
-		if node not in visited:
-			visited.append(node)
-			yield node
-			for child in node.children:
-				yield from self.preorder(child, visited)
-
-	def postorder(self, node, visited=None):
-		if visited is None:
-			visited = []
-
-		if node not in visited:
-			visited.append(node)
-			for child in node.children:
-				yield from self.postorder(child, visited)
-			yield node
 
+		visited = {id(node)}
+		# [node, next child of the node to walk]
+		stack = [[node, node.first_child]]
+		while stack:
+			entry = stack[-1]
+			child = entry[1]
+			if child is None:
+				stack.pop()
+				yield entry[0]
+				continue
+			entry[1] = child.next_sibling
+
+			if id(child) in visited:
+				continue
+			visited.add(id(child))
+			stack.append([child, child.first_child])
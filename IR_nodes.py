@@ -1,69 +1,152 @@
 
-from utils.random_util import RandomUtil
 from utils.graph_util import *
+from utils.cost_util import estimate_cost
 
 from IR_nodes import *
 
 import copy
 
 
-random_util = RandomUtil(123)
+'''
+	Whether any node of the subtree under a node awaits. Summaries are computed bottom-up and cached on the nodes.
+'''
+class SubtreeSummary:
+	__slots__ = ('contains_async',)
+
+	def __init__(self, node):
+		self.contains_async = node.contains_async
+		child = node.first_child
+		while child is not None and not self.contains_async:
+			self.contains_async = child.summary.contains_async
+			child = child.next_sibling
 
+'''
+	Nodes are slotted to keep them compact. Children are kept as an intrusive doubly linked list of siblings
+	(first_child/last_child on the parent, prev_sibling/next_sibling on the child), so adding and removing a child
+	is O(1) and nodes store no list of children (the children property builds one on access). Subclasses must
+	declare __slots__ (empty if they add no attributes).
+	Adding or removing a child drops the cached summaries of the node and its ancestors. A node is only summarized
+	after its children, so the walk up stops at the first node without a summary.
+'''
 class IRGraphNode:
+	__slots__ = (
+		'IR_graph', 'id', 'lua_node', 'name', 'name_extra', 'contains_async',
+		'parent', 'first_child', 'last_child', 'prev_sibling', 'next_sibling', 'summary',
+	)
+
 	def __init__(self, lua_node):
 		self.IR_graph = None
 		self.id = -1
 		self.lua_node = lua_node
-		if lua_node:
-			self.name = lua_node._name
+		self.name = lua_node._name if lua_node else ''
 		self.name_extra = ''
 		self.parent = None
-		self.children = []
+		self.first_child = None
+		self.last_child = None
+		self.prev_sibling = None
+		self.next_sibling = None
 		self.contains_async = False
+		self.summary = None
 
-
+	'''
+		Copies are shallow: the copy shares its lua_node payload with the original and is detached from any graph.
+	'''
 	def __copy__(self):
 		cls = self.__class__
 		new_instance = cls.__new__(cls)
-		for attr, value in self.__dict__.items():
-			if isinstance(value, list):
-				setattr(new_instance, attr, copy.deepcopy(value))
-			else:
-				setattr(new_instance, attr, value)
+		for slots_cls in cls.__mro__:
+			for attr in getattr(slots_cls, '__slots__', ()):
+				if hasattr(self, attr):
+					setattr(new_instance, attr, getattr(self, attr))
 
 		new_instance.IR_graph = None
 		new_instance.id = -1
-		new_instance.lua_node = self.lua_node
-		new_instance.name = self.name
 		new_instance.parent = None
-		new_instance.children = []
+		new_instance.first_child = None
+		new_instance.last_child = None
+		new_instance.prev_sibling = None
+		new_instance.next_sibling = None
+		new_instance.summary = None
 		return new_instance
 
-	# def __copy__(self):
-	# 	cls = self.__class__
-	# 	result = cls.__new__(cls)
-	# 	result.IR_graph = None
-	# 	result.id = -1
-	# 	result.lua_node = self.lua_node
-	# 	result.name = self.name
-	# 	result.parent = None
-	# 	result.children = []
-	# 	return result
+	'''
+		Snapshot of the children, in order, built on each access. Mutating the returned list does not change the node.
+		Hot paths (the traversals) follow first_child and next_sibling instead.
+	'''
+	@property
+	def children(self):
+		children = []
+		child = self.first_child
+		while child is not None:
+			children.append(child)
+			child = child.next_sibling
+		return children
 
 	def add_child(self, child):
+		self.invalidate_summary()
 		child.parent = self
-		self.children.append(child)
+		child.prev_sibling = self.last_child
+		child.next_sibling = None
+		if self.last_child is None:
+			self.first_child = child
+		else:
+			self.last_child.next_sibling = child
+		self.last_child = child
   
 	def add_children(self, children):
 		for child in children:
-			child.parent = self
-		self.children.extend(children)
+			self.add_child(child)
    
 	def remove_child(self, removed_child):
-		self.children = [child for child in self.children if child is not removed_child]
+		# Not a child of this node (or already removed)
+		if removed_child.parent is not self:
+			return
+		if removed_child.prev_sibling is None and self.first_child is not removed_child:
+			return
+		self.invalidate_summary()
+
+		if removed_child.prev_sibling is None:
+			self.first_child = removed_child.next_sibling
+		else:
+			removed_child.prev_sibling.next_sibling = removed_child.next_sibling
+
+		if removed_child.next_sibling is None:
+			self.last_child = removed_child.prev_sibling
+		else:
+			removed_child.next_sibling.prev_sibling = removed_child.prev_sibling
+
+		removed_child.prev_sibling = None
+		removed_child.next_sibling = None
    
 	def remove_children(self, removed_children):
-		self.children = [child for child in self.children if child not in removed_children]
+		for removed_child in removed_children:
+			self.remove_child(removed_child)
+
+	def invalidate_summary(self):
+		node = self
+		while node is not None and node.summary is not None:
+			node.summary = None
+			node = node.parent
+
+	'''
+		Summary of the subtree under the node, computed for the nodes of the subtree that have none.
+	'''
+	def subtree_summary(self):
+		stack = [(self, False)]
+		while stack:
+			node, children_summarized = stack.pop()
+			if node.summary is not None:
+				continue
+			if not children_summarized:
+				stack.append((node, True))
+				child = node.first_child
+				while child is not None:
+					if child.summary is None:
+						stack.append((child, False))
+					child = child.next_sibling
+				continue
+			node.summary = SubtreeSummary(node)
+		return self.summary
 
 
 
@@ -78,14 +161,29 @@ class IRGraphNode:
 	and do not require any modification
 '''
 class RegularIRGraphNode(IRGraphNode):
+	__slots__ = ('cost',)
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
+		self.cost = None
+
+	'''
+		Estimated cost of running the statement, computed once
+	'''
+	def estimated_cost(self):
+		if self.cost is None:
+			self.cost = estimate_cost(self.lua_node) if self.lua_node is not None else 0
+		return self.cost
 
 class FunctionIRGraphNode(RegularIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
   
 class LocalFunctionIRGraphNode(RegularIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -93,6 +191,8 @@ class LocalFunctionIRGraphNode(RegularIRGraphNode):
 	Local assignments 
 '''
 class LocalAssignIRGraphNode(RegularIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -100,6 +200,8 @@ class LocalAssignIRGraphNode(RegularIRGraphNode):
 	Global assignments
 '''
 class GlobalAssignIRGraphNode(RegularIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
   
@@ -107,6 +209,8 @@ class GlobalAssignIRGraphNode(RegularIRGraphNode):
 	Semicolons
 '''
 class SemicolonIRGraphNode(RegularIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
  
@@ -115,6 +219,8 @@ class SemicolonIRGraphNode(RegularIRGraphNode):
 	but given that all variables will be converted to global variables anyways it doesn't matter.
 '''
 class DoIRGraphNode(RegularIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -130,6 +236,8 @@ class DoIRGraphNode(RegularIRGraphNode):
 	Asynchronous graph nodes
 '''
 class AsyncIRGraphNode(IRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 		self.name = lua_node._name + ' (A)'
@@ -139,6 +247,8 @@ class AsyncIRGraphNode(IRGraphNode):
 	Asynchronous function calling
 '''
 class AsyncCallIRGraphNode(AsyncIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -146,6 +256,8 @@ class AsyncCallIRGraphNode(AsyncIRGraphNode):
 	Asynchronous assignments
 '''
 class AsyncAssignIRGraphNode(AsyncIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -157,6 +269,8 @@ class AsyncAssignIRGraphNode(AsyncIRGraphNode):
 '''
 
 class ControlStructureIRGraphNode(IRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -164,23 +278,33 @@ class ControlStructureIRGraphNode(IRGraphNode):
 	Conditional graph nodes (children to generated branch nodes)
 '''
 class ConditionalIRGraphNode(ControlStructureIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node, name=""):
 		super().__init__(lua_node)
 		if name != "": self.name = name
 
 class BreakIRGraphNode(ControlStructureIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
   
 class ReturnIRGraphNode(ControlStructureIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
 class GotoIRGraphNode(ControlStructureIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
   
 class LabelIRGraphNode(ControlStructureIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -191,8 +315,15 @@ class LabelIRGraphNode(ControlStructureIRGraphNode):
 ################################################
 '''
 class LoopIRGraphNode(IRGraphNode):
+	__slots__ = ('head_graph', 'join_graph', 'state_name')
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
+		# Set when a loop with an async node in its body is lowered: the execution graph re-entered for each iteration,
+		# the graph holding the code after the loop, and the prefix of the names the loop keeps its state in
+		self.head_graph = None
+		self.join_graph = None
+		self.state_name = None
 
 
 '''
@@ -200,6 +331,8 @@ class LoopIRGraphNode(IRGraphNode):
 	otherwise, Lua executes the body of the loop and repeats the process.
 '''
 class WhileIRGraphNode(LoopIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -208,6 +341,8 @@ class WhileIRGraphNode(LoopIRGraphNode):
 	The test is done after the body, so the body is always executed at least once.
 '''
 class RepeatIRGraphNode(LoopIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -215,6 +350,8 @@ class RepeatIRGraphNode(LoopIRGraphNode):
 	The generic for loop allows you to traverse all values returned by an iterator function.
 '''  
 class ForinIRGraphNode(LoopIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 '''
@@ -222,6 +359,8 @@ class ForinIRGraphNode(LoopIRGraphNode):
 	All three expressions in the declaration of the for loop are evaluated once, before the loop starts. 
 '''
 class FornumIRGraphNode(LoopIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -232,6 +371,8 @@ class FornumIRGraphNode(LoopIRGraphNode):
 '''
 
 class GeneratedIRGraphNode(IRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 
@@ -240,6 +381,8 @@ class GeneratedIRGraphNode(IRGraphNode):
 	Helper node for statements with bodies
 '''
 class GeneratedBlockIRGraphNode(IRGraphNode):
+	__slots__ = ()
+
 	def __init__(self, lua_node=None):
 		super().__init__(lua_node)
 		self.name = "Block (G)"
@@ -248,36 +391,47 @@ class GeneratedBlockIRGraphNode(IRGraphNode):
 	Links IR graphs together, dst_node will be the root node of another IR graph
 '''
 class GeneratedLinkIRGraphNode(GeneratedIRGraphNode):
+	__slots__ = ('async_link', 'generated_link_name', 'linked_graph')
+
 	def __init__(self, linked_graph, async_link):
 		super().__init__(lua_node=None)
+		if linked_graph is None:
+			raise ValueError("Error: A link needs the graph it links to.")
 		self.async_link = async_link
-		self.generated_link_name = random_util.generate_function_name()
-		self.name = "Link " + ("(A) " if self.async_link else "") + self.generated_link_name[5:10] + " → " + linked_graph.generated_name[5:10] + " (G)" 
+		# Links are named by the RandomUtil of the translation they belong to
+		self.generated_link_name = linked_graph.random_util.generate_link_name()
+		self.name = "Link " + ("(A) " if self.async_link else "") + self.generated_link_name + " → " + linked_graph.generated_name + " (G)" 
 		self.linked_graph = linked_graph 
-		if self.linked_graph is None:
-			print("here")
-			exit()
 '''
 	Placeholder for a new function node
 '''
 class GeneratedFunctionIRGraphNode(GeneratedIRGraphNode):
+	__slots__ = ('generated_function_name',)
+
 	def __init__(self, generated_function_name):
 		super().__init__(lua_node=None)
 		self.generated_function_name = generated_function_name
-		self.name = "Function " + generated_function_name[5:10] + " (G)"
+		self.name = "Function " + generated_function_name + " (G)"
   
 '''
 	Intermediate reprsentation for conditionals. This node will contain each elseif/else statement.
 '''
 class GeneratedBranchIRGraphNode(GeneratedIRGraphNode):
+	__slots__ = ('else_statement_present', 'join_graph')
+
 	def __init__(self, lua_node):
 		super().__init__(lua_node)
 		self.name = 'Branch (G)'
 		self.else_statement_present = False
+		# Execution graph holding the code after the branch, once the branch is linearized. Every path through the
+		# branch that does not return continues there.
+		self.join_graph = None
 '''
 	Placeholder for new else node
 '''
 class GeneratedConditionalElseIRGraphNode(GeneratedIRGraphNode):
+	__slots__ = ()
+
 	def __init__(self):
 		super().__init__(lua_node=None)
 		self.name = "Else (G)"
@@ -286,9 +440,25 @@ class GeneratedConditionalElseIRGraphNode(GeneratedIRGraphNode):
 	Placeholder for setting the event pointer
 '''
 class GeneratedSetEventPointerNode(GeneratedIRGraphNode):
+	__slots__ = ('pointer',)
+
 	def __init__(self, pointer):
 		super().__init__(lua_node=None)
-		self.name = "SetEventPointer " + pointer[5:10]
+		self.name = "SetEventPointer " + pointer
 		self.pointer = pointer
   
 
+'''
+	Charges the cost of the slice that ran before it to the tick budget and continues in the resume graph, right away
+	or, when the budget of the tick is spent, on a later tick
+'''
+class GeneratedYieldIRGraphNode(GeneratedIRGraphNode):
+	__slots__ = ('cost', 'resume_graph', 'generated_state_name')
+
+	def __init__(self, cost, resume_graph):
+		super().__init__(lua_node=None)
+		self.name = f"Yield {cost}"
+		self.cost = cost
+		self.resume_graph = resume_graph
+		# Deferred slices are saved as this state, like the event pointer of an async link
+		self.generated_state_name = resume_graph.random_util.generate_link_name()
@@ -0,0 +1,185 @@
+"""
+    Scaling benchmark: translate time, peak memory and output size of synthetic scripts, sweeping one shape parameter
+    at a time (statements, awaits, depth, elseif_arms, arm_awaits) from a base shape, plus the scripts in tests/cases.py as fixed
+    anchors. Results can be saved and compared with the results of another release.
+
+    python benchmarks/bench_scaling.py [--repeats N] [--quick] [--json FILE] [--baseline FILE] [--tolerance 1.25]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import translator
+import tests.cases as cases
+from benchmarks.synthetic import generate_script
+from utils.stats_util import StatsLog
+
+
+# The innermost level awaits in its arms, so every level of the depth and elseif_arms sweeps is linearized
+BASE_SHAPE = {'statements': 20, 'awaits': 2, 'depth': 2, 'elseif_arms': 1, 'arm_awaits': 1}
+
+SWEEPS = {
+    'statements': [10, 50, 100, 200, 400],
+    'awaits': [0, 5, 10, 20, 40],
+    'depth': [0, 2, 4, 8, 16],
+    'elseif_arms': [0, 2, 4, 8, 16],
+    'arm_awaits': [0, 1, 2, 4, 8],
+}
+
+# A subset of each sweep, for a fast smoke run
+QUICK_SWEEPS = {parameter: values[:3] for parameter, values in SWEEPS.items()}
+
+
+def anchor_sources():
+    index = 1
+    while hasattr(cases, f"source_code_{index}"):
+        yield f"source_code_{index}", getattr(cases, f"source_code_{index}")
+        index += 1
+
+
+'''
+    Measures one script. Time is the best of the repeats, peak memory is measured on a separate run since tracemalloc
+    slows translation down. The counters come from the translation's stats.
+'''
+
+
+def measure(source, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        lua_source = translator.translate_source(source)
+        timings.append(time.perf_counter() - start)
+
+    stats = StatsLog()
+    tracemalloc.start()
+    translator.translate_source(source, stats=stats)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    translation_stats = stats.records[0]
+    return {
+        'time_ms': min(timings) * 1000,
+        'peak_memory_kb': peak_memory / 1024,
+        'output_bytes': len(lua_source.encode()),
+        'graphs': translation_stats.total('graphs_created') + 1,
+        'links': translation_stats.total('links_created'),
+        'nodes_moved': translation_stats.total('nodes_moved'),
+    }
+
+
+def run(sweeps, repeats):
+    results = {'anchors': {}, 'sweeps': {}}
+    # Warm up, so the first anchor is not charged for lazy imports
+    translator.translate_source(generate_script(**BASE_SHAPE))
+
+    for name, source in anchor_sources():
+        results['anchors'][name] = measure(source, repeats)
+
+    for parameter, values in sweeps.items():
+        points = []
+        for value in values:
+            shape = dict(BASE_SHAPE, **{parameter: value})
+            # Keep the shape valid when sweeping statements below the base awaits and vice versa, and likewise for
+            # depth and arm_awaits
+            shape['statements'] = max(shape['statements'], shape['awaits'])
+            if parameter == 'depth':
+                shape['arm_awaits'] = min(shape['arm_awaits'], shape['depth'])
+            else:
+                shape['depth'] = max(shape['depth'], shape['arm_awaits'])
+            points.append({'shape': shape, **measure(generate_script(**shape), repeats)})
+        results['sweeps'][parameter] = points
+    return results
+
+
+'''
+    Yields (label, metric, baseline value, value) for each measurement present in both results.
+'''
+
+
+def paired_measurements(baseline, results):
+    for name, measurement in results['anchors'].items():
+        if name in baseline['anchors']:
+            for metric, value in measurement.items():
+                yield name, metric, baseline['anchors'][name][metric], value
+
+    for parameter, points in results['sweeps'].items():
+        baseline_points = {json.dumps(point['shape'], sort_keys=True): point
+                           for point in baseline['sweeps'].get(parameter, [])}
+        for point in points:
+            baseline_point = baseline_points.get(json.dumps(point['shape'], sort_keys=True))
+            if baseline_point is None:
+                continue
+            for metric, value in point.items():
+                if metric != 'shape':
+                    yield f"{parameter}={point['shape'][parameter]}", metric, baseline_point[metric], value
+
+
+'''
+    Lists the measurements that grew by more than the tolerance (a ratio) since the baseline.
+    Times under a millisecond are too noisy to compare and are skipped.
+'''
+
+
+def find_regressions(baseline, results, tolerance):
+    regressions = []
+    for label, metric, baseline_value, value in paired_measurements(baseline, results):
+        if metric == 'time_ms' and baseline_value < 1:
+            continue
+        if baseline_value and value / baseline_value > tolerance:
+            regressions.append((label, metric, baseline_value, value))
+    return regressions
+
+
+def print_results(results):
+    columns = ('time_ms', 'peak_memory_kb', 'output_bytes', 'graphs', 'links', 'nodes_moved')
+    header = f"{'':<22}" + ''.join(f"{column:>16}" for column in columns)
+
+    print("anchors")
+    print(header)
+    for name, measurement in results['anchors'].items():
+        print(f"{name:<22}" + ''.join(f"{measurement[column]:>16.2f}" for column in columns))
+
+    for parameter, points in results['sweeps'].items():
+        print(f"\n{parameter} (others at {', '.join(f'{k}={v}' for k, v in BASE_SHAPE.items() if k != parameter)})")
+        print(header)
+        for point in points:
+            print(f"{point['shape'][parameter]:<22}" + ''.join(f"{point[column]:>16.2f}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--quick', action='store_true', help="Only run the smallest shapes of each sweep")
+    parser.add_argument('--json', help="Save the results to this file")
+    parser.add_argument('--baseline', help="Compare with results saved by an earlier run")
+    parser.add_argument('--tolerance', type=float, default=1.25, help="Growth ratio reported as a regression")
+    args = parser.parse_args()
+
+    results = run(QUICK_SWEEPS if args.quick else SWEEPS, args.repeats)
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = find_regressions(baseline, results, args.tolerance)
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}")
+        for label, metric, baseline_value, value in regressions:
+            print(f"  {label:<22}{metric:<16}{baseline_value:>12.2f} -> {value:.2f}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
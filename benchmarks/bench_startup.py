@@ -0,0 +1,91 @@
+"""
+    Startup benchmark: cold import of the translator, and cold import up to the first translation.
+    Each sample runs in a fresh interpreter.
+
+    python benchmarks/bench_startup.py [--samples N] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_TRANSLATION_SOURCE = """
+function doThing()
+    bar()
+    await(foo())
+    bar()
+end
+"""
+
+IMPORT_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import translator
+print(time.perf_counter() - start)
+print(','.join(module for module in ('graphviz', 'coloredlogs') if module in sys.modules))
+"""
+
+FIRST_TRANSLATION_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+import translator
+translator.translate_source(sys.argv[1])
+print(time.perf_counter() - start)
+print(','.join(module for module in ('graphviz', 'coloredlogs') if module in sys.modules))
+"""
+
+
+def sample(snippet, *args):
+    output = subprocess.run(
+        [sys.executable, '-c', snippet, *args],
+        cwd=REPO_ROOT, check=True, capture_output=True, text=True,
+    ).stdout.split('\n')
+    # The results are the last two lines, anything printed before them is ignored
+    timing, loaded_modules = output[-3], output[-2]
+    return float(timing), [module for module in loaded_modules.split(',') if module]
+
+
+def measure(snippet, samples, *args):
+    timings = []
+    loaded_modules = set()
+    for _ in range(samples):
+        timing, modules = sample(snippet, *args)
+        timings.append(timing * 1000)
+        loaded_modules.update(modules)
+    return {
+        'median_ms': statistics.median(timings),
+        'min_ms': min(timings),
+        'max_ms': max(timings),
+        'loaded_optional_modules': sorted(loaded_modules),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=10)
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = {
+        'import': measure(IMPORT_SNIPPET, args.samples),
+        'import_to_first_translation': measure(FIRST_TRANSLATION_SNIPPET, args.samples, FIRST_TRANSLATION_SOURCE),
+    }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, result in results.items():
+        print(f"{name:<30} median {result['median_ms']:7.1f} ms  "
+              f"(min {result['min_ms']:.1f}, max {result['max_ms']:.1f})  "
+              f"optional modules loaded: {', '.join(result['loaded_optional_modules']) or 'none'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+    Generator of synthetic Lua scripts of controlled shape, for the scaling benchmark.
+"""
+
+
+'''
+    Generates a script with one function holding:
+    - statements: sequential statements at the top level of the function, split around the branch
+    - awaits: how many of those statements are awaits, spread evenly across them
+    - depth: levels of nested if/elseif/else. The if arm of each level holds the next level, the other arms hold one
+      statement each
+    - elseif_arms: elseif arms of each level
+    - arm_awaits: how many levels, counted from the innermost, await in their elseif and else arms instead of calling.
+      Every level around an awaiting one contains an await too, so it is linearized
+    With depth 0 there is no branch. The size of the script is linear in every parameter.
+'''
+
+
+def generate_script(statements=10, awaits=0, depth=0, elseif_arms=0, arm_awaits=0):
+    if awaits > statements:
+        raise Exception("Error: A script cannot have more awaits than statements.")
+    if arm_awaits > depth:
+        raise Exception("Error: A script cannot have more awaiting levels than levels.")
+
+    await_indices = {index * statements // awaits for index in range(awaits)} if awaits else set()
+    top_level = []
+    for index in range(statements):
+        if index in await_indices:
+            top_level.append(f"await(wait_{index}())")
+        else:
+            top_level.append(f"call_{index}()")
+
+    body = top_level[:statements // 2] + _generate_branch(depth, elseif_arms, arm_awaits) + top_level[statements // 2:]
+    lines = ["function doThing()"] + ["\t" + line for line in body] + ["end"]
+    return "\n".join(lines) + "\n"
+
+
+def _generate_branch(depth, elseif_arms, arm_awaits, level=0):
+    if level == depth:
+        return [f"inner_{level}()"]
+
+    # Arm statements either call or await the same function
+    arm_statement = "await({}())" if level >= depth - arm_awaits else "{}()"
+    lines = [f"if value == {level} then"]
+    lines.extend("\t" + line for line in _generate_branch(depth, elseif_arms, arm_awaits, level + 1))
+    for arm in range(elseif_arms):
+        lines.append(f"elseif value == {level}.{arm + 1} then")
+        lines.append("\t" + arm_statement.format(f"arm_{level}_{arm}"))
+    lines.append("else")
+    lines.append("\t" + arm_statement.format(f"else_{level}"))
+    lines.append("end")
+    lines.append(f"after_{level}()")
+    return lines
@@ -0,0 +1,132 @@
+from IR_graph import IRGraph
+from IR_nodes import *
+from utils.graph_util import move_tree
+
+
+def build_chain(length):
+    graph = IRGraph()
+    for _ in range(length):
+        graph.add_node(GeneratedBlockIRGraphNode())
+    return graph
+
+
+def build_tree():
+    '''
+        root
+        ├── a
+        │   ├── c
+        │   └── d
+        └── b
+    '''
+    graph = IRGraph()
+    nodes = {}
+    for name in "rabcd":
+        nodes[name] = GeneratedBlockIRGraphNode()
+        nodes[name].name = name
+    graph.add_node(nodes["r"])
+    nodes["r"].add_children([nodes["a"], nodes["b"]])
+    nodes["a"].add_children([nodes["c"], nodes["d"]])
+    return graph, nodes
+
+
+def test_preorder_order():
+    graph, _ = build_tree()
+    assert [node.name for node in graph.preorder()] == list("racdb")
+
+
+def test_postorder_order():
+    graph, _ = build_tree()
+    assert [node.name for node in graph.postorder()] == list("cdabr")
+
+
+def test_nodes_are_slotted():
+    for node in (GeneratedBlockIRGraphNode(), GeneratedConditionalElseIRGraphNode(), GeneratedSetEventPointerNode("link_abcdefgh")):
+        assert not hasattr(node, "__dict__")
+
+
+def test_remove_child_relinks_siblings():
+    graph, nodes = build_tree()
+    extra = GeneratedBlockIRGraphNode()
+    extra.name = "e"
+    nodes["a"].add_child(extra)
+
+    nodes["a"].remove_child(nodes["d"])
+    assert [node.name for node in nodes["a"].children] == list("ce")
+    # Removing twice, or removing a node that is not a child, is a no-op
+    nodes["a"].remove_child(nodes["d"])
+    nodes["a"].remove_child(nodes["b"])
+    assert [node.name for node in nodes["a"].children] == list("ce")
+
+    nodes["a"].remove_children([nodes["c"], extra])
+    assert nodes["a"].children == []
+    assert nodes["a"].first_child is None and nodes["a"].last_child is None
+
+
+def test_preorder_visits_children_added_during_walk():
+    graph, nodes = build_tree()
+    names = []
+    for node in graph.preorder():
+        names.append(node.name)
+        if node.name == "b":
+            added = GeneratedBlockIRGraphNode()
+            added.name = "e"
+            node.add_child(added)
+    assert names == list("racdbe")
+
+
+def test_deep_chain_does_not_recurse():
+    depth = 20000
+    graph = build_chain(depth)
+    assert sum(1 for _ in graph.preorder()) == depth
+    assert sum(1 for _ in graph.postorder()) == depth
+    assert not graph.contains_async(graph.root_node)
+
+
+def test_descendants():
+    graph, nodes = build_tree()
+    assert [node.name for node in graph.get_descendants(nodes["r"])] == list("acdb")
+
+
+def test_move_tree_moves_without_copying():
+    graph, nodes = build_tree()
+    dst_graph = IRGraph()
+    dst_graph.add_node(GeneratedBlockIRGraphNode())
+
+    moved = move_tree(src_node=nodes["a"], dst_graph=dst_graph, dst_node=dst_graph.root_node)
+
+    assert [node.name for node in moved] == list("acd")
+    assert nodes["a"].parent is dst_graph.root_node
+    assert all(node.IR_graph is dst_graph for node in moved)
+    assert [node.name for node in graph.preorder()] == list("rb")
+
+
+def test_copy_is_shallow_and_detached():
+    graph, nodes = build_tree()
+    lua_node = object()
+    nodes["a"].lua_node = lua_node
+
+    copied = copy.copy(nodes["a"])
+
+    assert copied.lua_node is lua_node
+    assert copied.children == [] and copied.parent is None and copied.IR_graph is None
+    assert len(nodes["a"].children) == 2
+
+
+def test_summaries_are_cached_and_invalidated_on_mutation():
+    graph, nodes = build_tree()
+    assert not graph.contains_async(nodes["r"])
+    assert nodes["r"].summary is not None and nodes["c"].summary is not None
+
+    # Adding a child drops the summaries of the node and its ancestors only
+    extra = GeneratedBlockIRGraphNode()
+    extra.name = "e"
+    extra.contains_async = True
+    nodes["c"].add_child(extra)
+    assert nodes["r"].summary is None and nodes["a"].summary is None and nodes["c"].summary is None
+    assert nodes["b"].summary is not None
+
+    assert graph.contains_async(nodes["r"]) and graph.contains_async(nodes["a"]) and not graph.contains_async(nodes["b"])
+
+    nodes["r"].remove_child(nodes["a"])
+    assert not graph.contains_async(nodes["r"])
+
@@ -0,0 +1,86 @@
+import luaparser.ast as ast
+
+import tests.cases as cases
+import translator
+from utils.cache_util import TranslationCache, hash_lua_ast
+from utils.stats_util import StatsLog
+
+
+RESUBMITTED_SOURCE_CODE_1 = """
+-- Same script, reformatted
+function doThing()
+    bar()  -- first
+    await(foo())
+    bar()
+end
+"""
+
+
+def test_hash_ignores_whitespace_and_comments():
+    assert hash_lua_ast(ast.parse(cases.source_code_1)) == hash_lua_ast(ast.parse(RESUBMITTED_SOURCE_CODE_1))
+    assert hash_lua_ast(ast.parse(cases.source_code_1)) != hash_lua_ast(ast.parse(cases.source_code_2))
+
+
+def test_hash_includes_options():
+    lua_root_node = ast.parse(cases.source_code_1)
+    assert hash_lua_ast(lua_root_node, {"a": 1}) != hash_lua_ast(lua_root_node, {"a": 2})
+
+
+def test_resubmitted_script_hits_cache():
+    cache = TranslationCache()
+    entry = translator.translate_script(cases.source_code_1, cache=cache)
+    assert cache.misses == 1
+
+    assert translator.translate_script(RESUBMITTED_SOURCE_CODE_1, cache=cache) is entry
+    assert translator.translate_script(cases.source_code_1, cache=cache) is entry
+    assert cache.hits == 2
+    assert len(entry["event_table"]) == 1
+
+
+def test_cached_output_matches_uncached_output():
+    assert translator.translate_source(RESUBMITTED_SOURCE_CODE_1) == translator.translate_source(cases.source_code_1)
+
+
+def test_lru_eviction():
+    cache = TranslationCache(max_entries=2)
+    for key in "abc":
+        cache.put(key, {"lua_source": key})
+    assert cache.get("a") is None
+    assert cache.get("b") is not None and cache.get("c") is not None
+
+
+def test_disk_cache_survives_new_instance(tmp_path):
+    entry = translator.translate_script(cases.source_code_2, cache=TranslationCache(cache_dir=str(tmp_path)))
+
+    cache = TranslationCache(cache_dir=str(tmp_path))
+    assert translator.translate_script(cases.source_code_2, cache=cache) == entry
+    assert cache.hits == 1 and cache.misses == 0
+
+
+def test_parallel_translation_fills_cache():
+    sources = [getattr(cases, f"source_code_{i}") for i in range(1, 5)]
+    cache = TranslationCache()
+    parallel = list(translator.translate_many(sources, jobs=2, cache=cache))
+    assert len(cache) == len(sources)
+    assert list(translator.translate_many(sources, cache=cache)) == parallel
+
+
+def test_parallel_translation_hits_cache_on_reformatted_script():
+    cache = TranslationCache()
+    entry = translator.translate_script(cases.source_code_1, cache=cache)
+
+    stats = StatsLog()
+    assert list(translator.translate_many([RESUBMITTED_SOURCE_CODE_1], jobs=2, cache=cache, stats=stats)) == [entry["lua_source"]]
+    assert stats.records[0].cached
+
+
+def test_disk_cache_is_bounded_and_skips_corrupt_entries(tmp_path):
+    cache = TranslationCache(cache_dir=str(tmp_path), max_disk_entries=10)
+    for index in range(25):
+        cache.put(f"key{index}", {"lua_source": str(index)})
+    assert len(list(tmp_path.glob("*.json"))) <= 10
+
+    (tmp_path / "corrupt.json").write_text("{not json")
+    cache = TranslationCache(cache_dir=str(tmp_path))
+    assert cache.get("corrupt") is None
+    assert cache.misses == 1
@@ -0,0 +1,19 @@
+import luaparser.ast as ast
+
+from utils.cost_util import CALL_COST, estimate_cost
+
+
+def parse_statement(source):
+    return ast.parse(source).body.body[0]
+
+
+def test_calls_cost_more_than_plain_statements():
+    assignment = parse_statement("a = b + 1")
+    call = parse_statement("a = f(b)")
+    assert estimate_cost(call) - estimate_cost(assignment) >= CALL_COST - 1
+
+
+def test_anonymous_function_bodies_are_not_counted():
+    short = parse_statement("f = function() end")
+    long = parse_statement("f = function() g() g() g() end")
+    assert estimate_cost(short) == estimate_cost(long)
@@ -0,0 +1,24 @@
+import re
+
+from utils.random_util import RandomUtil
+
+
+def test_names_are_unique_identifiers_tagged_with_the_seed():
+    random_util = RandomUtil(7)
+    names = [random_util.generate_function_name() for _ in range(500)] + \
+        [random_util.generate_link_name() for _ in range(500)]
+
+    assert len(set(names)) == len(names)
+    assert all(re.fullmatch(r"[fl]_0{15}7_[0-9a-f]+", name) for name in names)
+
+
+def test_names_depend_only_on_the_seed():
+    first, second = RandomUtil(7), RandomUtil(7)
+    assert [first.generate_function_name() for _ in range(3)] == [second.generate_function_name() for _ in range(3)]
+    assert RandomUtil(8).generate_function_name() != RandomUtil(7).generate_function_name()
+
+
+def test_tags_carry_the_whole_seed():
+    seed = int("0123456789abcdef", 16)
+    assert RandomUtil(seed).tag == "0123456789abcdef"
+    assert RandomUtil(seed + 1).tag != RandomUtil(seed).tag
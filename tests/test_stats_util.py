@@ -0,0 +1,53 @@
+import io
+import json
+import re
+
+import tests.cases as cases
+import translator
+from utils.cache_util import TranslationCache
+from utils.stats_util import StatsLog, TranslationStats
+from utils.trace_util import ALL_PASSES
+
+
+def test_stats_cover_every_pass():
+    stats = StatsLog()
+    entry = translator.translate_script(cases.source_code_6, stats=stats)
+
+    translation_stats = stats.records[0]
+    assert tuple(pass_stats.name for pass_stats in translation_stats.passes) == ALL_PASSES
+    assert translation_stats["build"].nodes_visited > 0
+    # Every graph created and not merged away is a function of the output, every link an event of the script
+    generated_functions = len(re.findall(r"^function f_", entry["lua_source"], re.MULTILINE))
+    assert translation_stats.total("graphs_created") - translation_stats.total("graphs_merged") == generated_functions
+    assert translation_stats.total("links_created") == len(entry["event_table"])
+    assert translation_stats.wall_time > 0
+
+
+def test_cache_hits_are_recorded_as_cached():
+    stats = StatsLog()
+    cache = TranslationCache()
+    list(translator.translate_many([cases.source_code_1, cases.source_code_1], cache=cache, stats=stats))
+
+    assert [record.cached for record in stats.records] == [False, True]
+    assert stats.records[1].passes == []
+
+
+def test_parallel_stats_match_serial_counters():
+    serial, parallel = StatsLog(), StatsLog()
+    list(translator.translate_many([cases.source_code_4, cases.source_code_5], stats=serial))
+    list(translator.translate_many([cases.source_code_4, cases.source_code_5], jobs=2, stats=parallel))
+
+    def counters(record):
+        return [{k: v for k, v in pass_stats.to_dict().items() if k != "wall_time"} for pass_stats in record.passes]
+    assert [counters(record) for record in serial.records] == [counters(record) for record in parallel.records]
+
+
+def test_json_export_round_trips():
+    stats = StatsLog()
+    translator.translate_source(cases.source_code_2, stats=stats)
+
+    stream = io.StringIO()
+    stats.dump_json(stream, names=["two"])
+    record = json.loads(stream.getvalue())
+    assert record["name"] == "two"
+    assert TranslationStats.from_dict(record).to_dict() == stats.records[0].to_dict()
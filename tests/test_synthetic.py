@@ -0,0 +1,29 @@
+import luaparser.ast as ast
+
+import translator
+from benchmarks.synthetic import generate_script
+from utils.stats_util import StatsLog
+
+
+def test_synthetic_scripts_have_the_requested_shape():
+    source = generate_script(statements=12, awaits=3, depth=3, elseif_arms=2)
+    assert source.count("await(") == 3
+    assert source.count("call_") + source.count("wait_") == 12
+    lines = [line.strip() for line in source.splitlines()]
+    assert sum(line.startswith("if ") for line in lines) == 3
+    assert sum(line.startswith("elseif ") for line in lines) == 6
+    ast.parse(source)
+
+
+def test_synthetic_scripts_translate():
+    for shape in ({}, {"awaits": 4}, {"depth": 4, "elseif_arms": 3}):
+        ast.parse(translator.translate_source(generate_script(**shape)))
+
+
+def test_awaiting_arms_are_linearized():
+    source = generate_script(statements=4, depth=3, elseif_arms=1, arm_awaits=2)
+    assert source.count("await(") == 2 * 2
+
+    stats = StatsLog()
+    ast.parse(translator.translate_source(source, stats=stats))
+    assert stats.records[0]["linearize"].graphs_created > 0
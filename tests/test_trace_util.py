@@ -0,0 +1,40 @@
+import io
+
+import pytest
+
+import tests.cases as cases
+import translator
+from utils.trace_util import Tracer
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer()
+    translator.translate_source(cases.source_code_5, tracer=tracer)
+    assert tracer.events == []
+
+
+def test_trace_is_per_pass():
+    tracer = Tracer(["linearize"])
+    translator.translate_source(cases.source_code_4, tracer=tracer)
+
+    assert tracer.events
+    assert {pass_name for pass_name, _, _ in tracer.events} == {"linearize"}
+    assert "found_post_exeuction_tree" in {event for _, event, _ in tracer.events}
+
+
+def test_dump_formats_buffered_events():
+    tracer = Tracer("all")
+    translator.translate_source(cases.source_code_1, tracer=tracer)
+
+    stream = io.StringIO()
+    tracer.dump(stream)
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == len(tracer.events)
+    assert any(line.startswith("[build] visit_call await") for line in lines)
+    assert any(line.startswith("[separate_async] move_tree") for line in lines)
+
+
+def test_single_pass_name_and_unknown_passes():
+    assert Tracer("linearize").passes == {"linearize"}
+    with pytest.raises(Exception):
+        Tracer(["linearise"])
@@ -0,0 +1,520 @@
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+
+import luaparser.ast as ast
+import pytest
+
+import tests.cases as cases
+import translator
+from benchmarks.synthetic import generate_script
+from utils.stats_util import StatsLog
+
+
+SOURCES = [getattr(cases, f"source_code_{i}") for i in range(1, 9)]
+
+
+def top_level_functions(lua_source):
+    return {node.name.id: node.body.body for node in ast.parse(lua_source).body.body if isinstance(node, translator.astnodes.Function)}
+
+
+def called_function(statement):
+    if isinstance(statement, translator.astnodes.Return) and len(statement.values) == 1:
+        statement = statement.values[0]
+    if isinstance(statement, translator.astnodes.Call) and isinstance(statement.func, translator.astnodes.Name):
+        return statement.func.id
+    return None
+
+
+def test_translations_are_valid_lua():
+    for lua_source in translator.translate_many(SOURCES):
+        ast.parse(lua_source)
+
+
+def test_translate_many_yields_one_output_per_input():
+    assert len(list(translator.translate_many(SOURCES))) == len(SOURCES)
+
+
+def test_async_call_sets_event_pointer_before_awaiting():
+    lua_source = translator.translate_source(cases.source_code_1)
+    main_function = lua_source[lua_source.index("function doThing()"):]
+    assert main_function.index(translator.CURRENT_EVENT_PTR_NAME) < main_function.index("await(foo())")
+    assert lua_source.count(translator.REGISTER_EVENT_FUNCTION_NAME) == 1
+
+
+def test_cli_translates_directory(tmp_path):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    (input_dir / "one.lua").write_text(cases.source_code_1)
+    (input_dir / "two.lua").write_text(cases.source_code_2)
+    (input_dir / "notes.txt").write_text("not a script")
+
+    translator.main([str(input_dir), "-o", str(tmp_path / "out")])
+
+    assert sorted(os.listdir(tmp_path / "out")) == ["one.lua", "two.lua"]
+
+
+def test_cli_leaves_no_partial_file_on_failure(tmp_path):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    (input_dir / "broken.lua").write_text("function doThing()\n    await(foo())\nend\nfunction other()\nend\n")
+
+    with pytest.raises(Exception):
+        translator.main([str(input_dir), "-o", str(tmp_path / "out")])
+
+    assert os.listdir(tmp_path / "out") == []
+
+
+def test_cli_translates_stream(tmp_path, monkeypatch):
+    stream = "\n".join(json.dumps({"name": f"script_{i}", "source": source}) for i, source in enumerate(SOURCES[:3]))
+    monkeypatch.setattr("sys.stdin", io.StringIO(stream))
+
+    translator.main(["-", "-o", str(tmp_path)])
+
+    assert sorted(os.listdir(tmp_path)) == ["script_0.lua", "script_1.lua", "script_2.lua"]
+
+
+def test_translation_is_deterministic_and_order_independent():
+    forward = list(translator.translate_many(SOURCES))
+    backward = list(translator.translate_many(reversed(SOURCES)))
+    assert forward == backward[::-1]
+
+
+def test_parallel_translation_matches_serial():
+    assert list(translator.translate_many(SOURCES, jobs=2)) == list(translator.translate_many(SOURCES))
+
+
+def test_import_has_no_side_effects():
+    snippet = (
+        "import logging, sys, translator\n"
+        "assert 'graphviz' not in sys.modules and 'coloredlogs' not in sys.modules\n"
+        "assert not logging.getLogger().handlers\n"
+    )
+    subprocess.run([sys.executable, "-c", snippet], check=True, cwd=os.path.dirname(os.path.dirname(__file__)) or ".")
+
+
+def test_streamed_output_matches_translated_output():
+    for source in SOURCES:
+        sink = io.StringIO()
+        translator.write_script(source, sink)
+        assert sink.getvalue() == translator.translate_source(source)
+
+
+def test_cli_bundles_scripts_into_one_file(tmp_path):
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    for index, source in enumerate(SOURCES[:3]):
+        (input_dir / f"{index}.lua").write_text(source)
+
+    translator.main([str(input_dir), "--bundle", str(tmp_path / "bundle.lua")])
+
+    bundle = (tmp_path / "bundle.lua").read_text()
+    assert bundle == "\n\n".join(translator.translate_many(SOURCES[:3]))
+    ast.parse(bundle)
+
+
+def test_dispatcher_mode_registers_one_handler():
+    lua_source = translator.translate_source(cases.source_code_5, event_mode="dispatcher")
+    ast.parse(lua_source)
+    assert lua_source.count(translator.REGISTER_EVENT_FUNCTION_NAME) == 1
+    assert lua_source.count(translator.GENERATE_EVENT_NAME_FUNCTION_NAME) == 1
+    assert translator.EVENT_NAME_TABLE_NAME not in lua_source
+    # Every async link is still routed through the pointer table, after the functions it points to are defined
+    event_table = translator.translate_script(cases.source_code_5, event_mode="dispatcher")["event_table"]
+    for link_name, function_name in event_table.items():
+        assert f"{translator.EVENT_PTR_TABLE_NAME}['{link_name}'] = {function_name}" in lua_source
+        assert lua_source.index(f"function {function_name}()") < lua_source.index(f"['{link_name}'] =")
+
+
+def test_unknown_event_mode_is_rejected():
+    with pytest.raises(Exception):
+        translator.translate_source(cases.source_code_1, event_mode="coroutines")
+
+
+def test_integer_state_ids_replace_link_names():
+    entry = translator.translate_script(cases.source_code_5, state_ids="integers")
+    lua_source = entry["lua_source"]
+    ast.parse(lua_source)
+    for link_name in entry["event_table"]:
+        assert link_name not in lua_source
+    assert entry["state_count"] == len(entry["event_table"]) == 5
+    assert f"global.{translator.STATE_COUNT_NAME} = " in lua_source
+    assert f"global.{translator.STATE_BASES_NAME}[" in lua_source
+
+
+FRAME_SOURCE = """
+function work(name, n)
+    local count = n
+    for i = 1, count do
+        log(i)
+    end
+    await(wait())
+    if count > 1 then
+        return count
+    else
+        log(name)
+    end
+end
+"""
+
+
+def test_frames_hold_locals_and_are_freed_on_every_path():
+    lua_source = translator.translate_source(FRAME_SOURCE, frames=True)
+    ast.parse(lua_source)
+
+    assert "local count" not in lua_source
+    assert "frame.count = frame.n" in lua_source
+    # Loop variables stay locals
+    assert "for i = 1, frame.count do" in lua_source and "log(i)" in lua_source
+    # One free on each path (the return and the else), besides the pool's own definition
+    assert lua_source.count(f"{translator.FREE_FRAME_FUNCTION_NAME}(frame)") - 1 == 2
+    assert f"{translator.CURRENT_FRAME_NAME} = frame" in lua_source
+
+
+def test_frames_evaluate_return_values_before_the_frame_is_freed():
+    lua_source = translator.translate_source(FRAME_SOURCE, frames=True)
+
+    read = lua_source.index(f"local {translator.RETURN_VALUE_NAME}_1 = frame.count")
+    free = lua_source.index(f"{translator.FREE_FRAME_FUNCTION_NAME}(frame)", read)
+    assert lua_source.index(f"return {translator.RETURN_VALUE_NAME}_1", free) > free
+
+    # Calls in the last place keep all of their values
+    lua_source = translator.translate_source("function f()\n    await(x())\n    return g()\nend\n", frames=True)
+    assert f"local {translator.RETURN_VALUE_NAME} = table.pack(g())" in lua_source
+
+
+SHADOWING_SOURCE = """
+function doThing(a)
+    local x = a
+    local cb = function(y)
+        local tmp = y * 2
+        return tmp + x
+    end
+    if x then
+        local x = x + 1
+        await(foo(x))
+        bar(x)
+    end
+    bar(x, cb(x))
+end
+"""
+
+
+def test_frames_keep_closure_locals_and_give_shadowing_locals_their_own_field():
+    lua_source = translator.translate_source(SHADOWING_SOURCE, frames=True)
+    ast.parse(lua_source)
+
+    # The closure's local stays a Lua local, the closure still reads the frame
+    assert "local tmp = y * 2" in lua_source and "return tmp + frame.x" in lua_source
+    # The inner x is a field of its own, initialized from the outer one
+    assert "frame.x_2 = frame.x + 1" in lua_source
+    assert "bar(frame.x_2)" in lua_source and "bar(frame.x, frame.cb(frame.x))" in lua_source
+
+
+REPEAT_LOCAL_SOURCE = """
+function doThing()
+    local done = false
+    repeat
+        local done = check()
+    until done
+    await(x())
+    use(done)
+end
+"""
+
+
+def test_frames_rename_the_until_test_with_the_locals_of_the_repeat_body():
+    lua_source = translator.translate_source(REPEAT_LOCAL_SOURCE, frames=True)
+    ast.parse(lua_source)
+
+    assert "frame.done_2 = check()" in lua_source
+    assert "until frame.done_2" in lua_source
+    assert "use(frame.done)" in lua_source
+
+
+IDENTICAL_TAILS_SOURCE = """
+function doThing()
+    if a() then
+        await(x())
+        bar()
+    else
+        await(x())
+        bar()
+    end
+end
+"""
+
+
+def test_identical_continuations_are_merged():
+    entry = translator.translate_script(IDENTICAL_TAILS_SOURCE)
+    lua_source = entry["lua_source"]
+    ast.parse(lua_source)
+
+    # Both awaits resume one function through one event
+    assert len(entry["event_table"]) == 1
+    assert lua_source.count("bar()") == 1
+    assert lua_source.count(translator.REGISTER_EVENT_FUNCTION_NAME) == 1
+    (link_name,) = entry["event_table"]
+    assert lua_source.count(f"{translator.CURRENT_EVENT_PTR_NAME} = '{link_name}'") == 2
+
+
+def test_forwarding_continuations_are_merged():
+    stats = StatsLog()
+    lua_source = translator.translate_source(cases.source_code_5, stats=stats)
+    functions = top_level_functions(lua_source)
+
+    # No function is left that only goes on to another one, callers go straight to its target
+    forwarding = [name for name, body in functions.items() if len(body) == 1 and called_function(body[0]) in functions]
+    assert forwarding == []
+    # Each merged graph is one function less, every call still has its function
+    translation_stats = stats.records[0]
+    assert translation_stats["dedupe"].graphs_merged > 0
+    assert len(functions) == 1 + translation_stats.total("graphs_created") - translation_stats["dedupe"].graphs_merged
+    called = set(re.findall(r"\b(f_\w+)\(", lua_source))
+    assert called <= set(functions)
+
+
+NO_ELSE_SOURCE = """
+function doThing()
+    if a() then
+        await(x())
+    end
+    bar()
+end
+"""
+
+
+def test_branch_without_else_continues_in_its_join_graph():
+    entry = translator.translate_script(NO_ELSE_SOURCE)
+    lua_source = entry["lua_source"]
+    ast.parse(lua_source)
+
+    # The await resumes the code after the branch, which the path where a() is false calls directly
+    (join_name,) = entry["event_table"].values()
+    assert lua_source.count("bar()") == 1
+    assert f"else\n        return {join_name}()" in lua_source
+
+
+def test_synchronous_branches_stay_inline():
+    stats = StatsLog()
+    entry = translator.translate_script(generate_script(statements=4, depth=8, elseif_arms=2), stats=stats)
+
+    assert stats.records[0].total("graphs_created") == 0
+    assert entry["lua_source"].count("function ") == 1
+    assert entry["event_table"] == {}
+
+
+def test_linearizing_creates_no_links():
+    stats = StatsLog()
+    entry = translator.translate_script(cases.source_code_6, stats=stats)
+    lua_source = entry["lua_source"]
+
+    # The only links are the ones of the awaits, each resumed through its own event
+    assert stats.records[0]["linearize"].links_created == 0
+    assert stats.records[0].total("links_created") == cases.source_code_6.count("await(") == len(entry["event_table"])
+    # Branches that await continue in a join graph, the others stay inline with the code after them
+    assert re.search(r"await\(func1\(\)\)\s+return\s+else\s+return f_\w+\(\)", lua_source)
+    assert re.search(r"await\(func4\(\)\)\s+return\s+else\s+return f_\w+\(\)", lua_source)
+    assert re.search(r"func6\(\)\s+end\s+if y == z then\s+func7\(\)\s+end\s+local a = x \+ y", lua_source)
+
+
+BREAK_LOOP_SOURCE = """
+function doThing()
+    for k, v in pairs(items) do
+        await(visit(k))
+        if v then
+            break
+        end
+    end
+    done()
+end
+"""
+
+
+def test_awaiting_loops_are_lowered_to_one_state():
+    entry = translator.translate_script(cases.source_code_8)
+    lua_source = entry["lua_source"]
+    ast.parse(lua_source)
+
+    # The await in the loop resumes the head of the loop, whatever the number of iterations
+    assert "for i" not in lua_source
+    ((link_name, head_name),) = entry["event_table"].items()
+    assert f"function {head_name}()" in lua_source
+    assert lua_source.count(f"return {head_name}()") == 1
+
+
+AWAITING_REPEAT_SOURCE = """
+function doThing()
+    repeat
+        local n = step()
+        await(a1())
+    until n > 3
+    done()
+end
+"""
+
+
+def test_lowered_repeat_checks_its_test_at_the_end_of_the_body():
+    lua_source = translator.translate_source(AWAITING_REPEAT_SOURCE, frames=True)
+    ast.parse(lua_source)
+
+    assert "_first" not in lua_source
+    # The test reads the body's local once the await resumes, and goes back to the head only when it is false
+    match = re.search(r"await\(a1\(\)\)\s+end\s+function (\w+)\(frame\)\s+if frame\.n > 3 then\s+return (\w+)\(frame\)\s+else\s+return (\w+)\(frame\)", lua_source)
+    assert match
+    _, exit_name, head_name = match.groups()
+    assert f"function {exit_name}(frame)\n    done()" in lua_source
+    assert f"function {head_name}(frame)\n    frame.n = step()" in lua_source
+
+
+def test_synchronous_loops_stay_inline():
+    lua_source = translator.translate_source(cases.source_code_7)
+    assert "for i = 1, 10 do" in lua_source
+    assert "while localVar < 100 do" in lua_source
+
+
+def test_break_in_lowered_loop_exits_to_its_join_graph():
+    lua_source = translator.translate_source(BREAK_LOOP_SOURCE, frames=True)
+    ast.parse(lua_source)
+
+    assert "break" not in lua_source
+    assert re.search(r"frame\.(loop_\w+)_var_k, frame\.\1_var_v = frame\.\1_f\(", lua_source)
+    # done() runs once the loop ends, by its iterator or the break
+    assert lua_source.count("done()") == 1
+
+
+LAST_BREAK_LOOP_SOURCE = """
+function doThing()
+    for k, v in pairs(t) do
+        await(a1())
+        if c1() then
+            break
+        end
+        s2()
+    end
+end
+"""
+
+
+def test_break_in_lowered_loop_with_nothing_after_it_ends_the_invocation():
+    lua_source = translator.translate_source(LAST_BREAK_LOOP_SOURCE, frames=True)
+    ast.parse(lua_source)
+
+    # The break frees the frame once and returns before s2()
+    free = f"{translator.FREE_FRAME_FUNCTION_NAME}(frame)"
+    assert re.search(rf"if c1\(\) then\s+{re.escape(free)}\s+return\s+end\s+s2\(\)", lua_source)
+    assert re.search(r"if c1\(\) then\s+return\s+end\s+s2\(\)", translator.translate_source(LAST_BREAK_LOOP_SOURCE))
+
+
+LONG_SOURCE = """
+function doThing()
+    local a = 0
+    for i = 1, 10 do
+        a = a + foo(i)
+    end
+    bar(a)
+    bar(a)
+    bar(a)
+    bar(a)
+    await(baz())
+end
+"""
+
+
+def test_tick_budget_requires_frames():
+    with pytest.raises(Exception):
+        translator.translate_source(LONG_SOURCE, tick_budget=20)
+    with pytest.raises(Exception):
+        translator.translate_source(LONG_SOURCE, frames=True, tick_budget=0)
+
+
+def test_tick_budget_cuts_synchronous_code_into_slices():
+    entry = translator.translate_script(LONG_SOURCE, frames=True, tick_budget=20)
+    lua_source = entry["lua_source"]
+    ast.parse(lua_source)
+
+    assert lua_source.count("script.on_event(defines.events.on_tick") == 1
+    assert "fsm_tick_budget = 20" in lua_source
+    # Every iteration of the loop is charged, so the loop is lowered even though it does not await
+    assert "for i" not in lua_source
+    # Deferred slices are saved by state and resumed through the event ptr table
+    deferred_states = [state for state in entry["event_table"] if f"fsm_defer('{state}', frame)" in lua_source]
+    assert len(deferred_states) >= 2
+    for state in deferred_states:
+        assert f"global.event_ptrs['{state}'] = {entry['event_table'][state]}" in lua_source
+
+    # Without a budget nothing is sliced
+    assert "fsm_defer" not in translator.translate_source(LONG_SOURCE, frames=True)
+
+
+def test_event_pointers_are_set_after_their_functions_are_defined():
+    for source_code in (cases.source_code_1, cases.source_code_6, NO_ELSE_SOURCE):
+        entry = translator.translate_script(source_code)
+        lua_source = entry["lua_source"]
+        for link_name, function_name in entry["event_table"].items():
+            pointer_assignment = lua_source.index(f"global.event_ptrs['{link_name}'] = {function_name}")
+            assert lua_source.index(f"function {function_name}(") < pointer_assignment
+
+
+NESTED_LOOP_SOURCE = """
+function doThing()
+    for x = 1, 2 do
+        for y = 1, 2 do
+            await(visit(x, y))
+            log(x, y)
+        end
+        log(x)
+    end
+end
+"""
+
+
+def test_loop_variables_outlive_awaits_without_frames():
+    lua_source = translator.translate_source(NESTED_LOOP_SOURCE)
+    ast.parse(lua_source)
+
+    # Both loops are lowered and their variables are read from the loop state after the await
+    assert "local x" not in lua_source and "local y" not in lua_source
+    assert re.search(r"log\(global\.loop_\w+_var_x, global\.loop_\w+_var_y\)", lua_source)
+    assert re.search(r"log\(global\.loop_\w+_var_x\)", lua_source)
+
+
+def test_subclass_visitors_do_not_leak_into_the_base_class():
+    class CountingTranslator(translator.Translator):
+        def visit_Call(self, node):
+            self.calls = getattr(self, "calls", 0) + 1
+            return super().visit_Call(node)
+
+    counting = CountingTranslator(ast.parse(cases.source_code_1), render_visual_graph=False)
+    counting.translate()
+    assert counting.calls > 0
+
+    plain = translator.Translator(ast.parse(cases.source_code_1), render_visual_graph=False)
+    plain.translate()
+    assert translator.Translator.visitors[translator.astnodes.Call] is translator.Translator.visit_Call
+
+
+def test_batches_reject_distinct_scripts_with_the_same_tag():
+    tags = translator.TagChecker()
+    tags.check("00000000000000aa" + "1" * 48)
+    tags.check("00000000000000aa" + "1" * 48)
+    with pytest.raises(Exception):
+        tags.check("00000000000000aa" + "2" * 48)
+
+
+def test_chunk_level_statements_stay_at_the_top_level():
+    lua_source = translator.translate_source("bar()\nfunction f(a)\n    await(x())\n    foo(a)\nend\nbaz()\n")
+    chunk = ast.parse(lua_source).body.body
+
+    top_level_calls = [node.func.id for node in chunk
+                       if isinstance(node, translator.astnodes.Call) and isinstance(node.func, translator.astnodes.Name)]
+    assert top_level_calls[-2:] == ["bar", "baz"]
+    assert lua_source.index("bar()") < lua_source.index("function f(a)")
+    assert isinstance(chunk[-1], translator.astnodes.Call) and chunk[-1].func.id == "baz"
+    assert lua_source.count("baz()") == 1 and lua_source.count("bar()") == 1
+
+    # The module's return is kept, last
+    assert translator.translate_source(cases.source_code_8).rstrip().endswith("return mine_resource")
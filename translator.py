@@ -1,26 +1,24 @@
+import json
 import os
+import sys
 
-import tests.cases as cases
 import luaparser.ast as ast
 import luaparser.astnodes as astnodes
 
-from utils.random_util import RandomUtil
+from utils.random_util import RandomUtil, TAG_BITS, seed_tag
 from utils.graph_util import *
+from utils.cost_util import estimate_cost
+from utils.cache_util import TranslationCache, hash_lua_ast
+from utils.trace_util import Tracer
+from utils.stats_util import StatsLog, TranslationStats
 
 from IR_graph import IRGraph
 from IR_nodes import *
 
 
-from typing import List
-import coloredlogs, logging
-
-# windows only
-if os.name == 'nt':
-	os.environ["PATH"] += os.pathsep + 'C:/Program Files/Graphviz/bin/'
- 
-os.environ["COLOREDLOGS_LOG_FORMAT"] ='[%(hostname)s] %(funcName)s :: %(levelname)s :: %(message)s'
-
-coloredlogs.install(level='DEBUG')
+from contextlib import contextmanager
+from functools import partial
+import logging
 
 
 
@@ -39,7 +37,6 @@ coloredlogs.install(level='DEBUG')
 	- Error handling on invalid syntax
 	- Error handling on detected recursion
 	- Function closure (function inside function)
-	- Loops
  	- Async assignments
 	- Gotos and labels
  	- Objects/Methods
@@ -53,10 +50,127 @@ coloredlogs.install(level='DEBUG')
 '''
 EVENT_PTR_TABLE_NAME = 'global.event_ptrs'
 EVENT_NAME_TABLE_NAME = 'global.event_names'
+CURRENT_EVENT_PTR_NAME = 'global.current_event_ptr'
 
 GENERATE_EVENT_NAME_FUNCTION_NAME = 'script.generate_event_name'
 REGISTER_EVENT_FUNCTION_NAME = 'script.on_event'
 
+# Dispatcher event mode: one event shared by every translated script, raised with the link name in the event data
+DISPATCH_EVENT_NAME = 'fsm_dispatch_event'
+DISPATCH_EVENT_PTR_FIELD = 'event_ptr'
+
+# 'events': one custom event and handler per async link
+# 'dispatcher': one handler for all scripts, routing on the link name through the event ptr table
+EVENT_MODES = ('events', 'dispatcher')
+
+# 'names': states (async links) are keyed by their link name
+# 'integers': states are small integers, dense across every script loaded in the game. The first time a script is
+# loaded it reserves a range: its base is the running state count, and its states are base + 1..n. Bases are kept in
+# global by script tag, so the states saved in frames and event pointers keep their meaning across save/load, even if
+# the set or order of the scripts changes
+STATE_ID_MODES = ('names', 'integers')
+STATE_COUNT_NAME = 'fsm_state_count'
+STATE_BASES_NAME = 'fsm_state_bases'
+STATE_BASE_NAME = 'fsm_state_base'
+
+# Where control goes when generated code runs off the end of a block, besides continuing in another execution graph:
+# out of the statement holding the block (arms of a branch that was not linearized, loop bodies, and graphs called from
+# a loop body), or nowhere, which ends the invocation
+FALLTHROUGH = 'fallthrough'
+END_OF_INVOCATION = 'end_of_invocation'
+
+# Frames mode: each invocation keeps its locals and program counter in a frame table, taken from a pool shared by
+# every translated script. Before an await the frame is published in CURRENT_FRAME_NAME, and the runtime raises the
+# event of frame.pc with the frame in the event data
+FRAME_NAME = 'frame'
+FRAME_PC_FIELD = 'pc'
+CURRENT_FRAME_NAME = 'global.current_frame'
+ALLOC_FRAME_FUNCTION_NAME = 'fsm_alloc_frame'
+FREE_FRAME_FUNCTION_NAME = 'fsm_free_frame'
+FRAME_POOL_NAME = 'fsm_frame_pool'
+RETURN_VALUE_NAME = 'fsm_return'
+
+# Lua nodes that open a function scope of their own
+FUNCTION_NODE_TYPES = (astnodes.Function, astnodes.LocalFunction, astnodes.Method, astnodes.AnonymousFunction)
+
+# Without frames, lowered loops keep their counter or iterator in fields of this table
+LOOP_STATE_TABLE_NAME = 'global'
+
+# Tick budget: generated code charges the estimated cost of the code it ran to a budget shared by every translated
+# script, and once the budget of the tick is spent the rest is deferred to a later tick, resumed from on_tick
+# Deferred slices are saved in global as {state, frame} and resumed through the event ptr table, so they survive
+# save/load and every multiplayer client runs them alike
+BUDGET_NAME = 'global.fsm_budget'
+TICK_BUDGET_NAME = 'fsm_tick_budget'
+DEFER_FUNCTION_NAME = 'fsm_defer'
+DEFERRED_NAME = 'global.fsm_deferred'
+TICK_EVENT_NAME = 'defines.events.on_tick'
+# Estimated cost of testing the condition of a loop, charged with each iteration
+LOOP_TEST_COST = 1
+
+STATE_RANGE_SOURCE = f"""
+global.{STATE_BASES_NAME} = global.{STATE_BASES_NAME} or {{}}
+if not global.{STATE_BASES_NAME}['%(tag)s'] then
+	global.{STATE_BASES_NAME}['%(tag)s'] = global.{STATE_COUNT_NAME} or 0
+	global.{STATE_COUNT_NAME} = global.{STATE_BASES_NAME}['%(tag)s'] + %(state_count)d
+end
+%(state_base_name)s = global.{STATE_BASES_NAME}['%(tag)s']
+"""
+
+# Defined once for all the scripts loaded in the game. Frames are cleared when they are reused rather than when they
+# are freed, so a return statement can still read the frame after freeing it
+FRAME_POOL_SOURCE = f"""
+if not {ALLOC_FRAME_FUNCTION_NAME} then
+	{FRAME_POOL_NAME} = {{}}
+	function {ALLOC_FRAME_FUNCTION_NAME}()
+		local frame = table.remove({FRAME_POOL_NAME})
+		if frame then
+			for key in pairs(frame) do
+				frame[key] = nil
+			end
+			return frame
+		end
+		return {{}}
+	end
+	function {FREE_FRAME_FUNCTION_NAME}(frame)
+		table.insert({FRAME_POOL_NAME}, frame)
+	end
+end
+"""
+
+# Defined once for all the scripts loaded in the game, which must all have been translated with the same budget.
+# Slices deferred during a tick run on the next one, in the order they were deferred.
+SCHEDULER_SOURCE = f"""
+if {TICK_BUDGET_NAME} and {TICK_BUDGET_NAME} ~= %(tick_budget)d then
+	error("Error: Scripts translated with different tick budgets are loaded together.")
+end
+if not {DEFER_FUNCTION_NAME} then
+	{TICK_BUDGET_NAME} = %(tick_budget)d
+	{BUDGET_NAME} = {BUDGET_NAME} or {TICK_BUDGET_NAME}
+	{DEFERRED_NAME} = {DEFERRED_NAME} or {{}}
+	function {DEFER_FUNCTION_NAME}(state, frame)
+		table.insert({DEFERRED_NAME}, {{state, frame}})
+	end
+	script.on_event({TICK_EVENT_NAME}, function(event)
+		{BUDGET_NAME} = {TICK_BUDGET_NAME}
+		local deferred = {DEFERRED_NAME}
+		{DEFERRED_NAME} = {{}}
+		for _, slice in ipairs(deferred) do
+			{EVENT_PTR_TABLE_NAME}[slice[1]](slice[2])
+		end
+	end)
+end
+"""
+
+'''
+	The Lua printer does not add parentheses, so an operator used as the operand of a generated operator is marked
+	as wrapped, as the parser does for parenthesized expressions
+'''
+def wrap_expression(lua_node):
+	if isinstance(lua_node, (astnodes.BinaryOp, astnodes.UnaryOp)):
+		lua_node.wrapped = True
+	return lua_node
+
 '''
 ################################################
 	TRANSLATOR
@@ -64,21 +178,59 @@ REGISTER_EVENT_FUNCTION_NAME = 'script.on_event'
 '''
 
 class Translator:
-	def __init__(self, source_lua_root_node, render_visual_graph):
+	def __init__(self, source_lua_root_node, render_visual_graph, seed=123, tracer=None, event_mode='events', state_ids='names', frames=False, tick_budget=None):
 		self.source_lua_root_node = source_lua_root_node 
 		self.render_visual_graph = render_visual_graph
+
+		if event_mode not in EVENT_MODES:
+			raise Exception(f"Error: Unknown event mode '{event_mode}', expected one of {', '.join(EVENT_MODES)}.")
+		self.event_mode = event_mode
+
+		if state_ids not in STATE_ID_MODES:
+			raise Exception(f"Error: Unknown state id mode '{state_ids}', expected one of {', '.join(STATE_ID_MODES)}.")
+		self.state_ids = state_ids
+		# Async link name to state number, assigned when code is generated
+		self.state_numbers = {}
+
+		# Per invocation frames
+		self.frames = frames
+
+		# Work units generated code may run per tick, unlimited if None. Slicing splits functions anywhere, so the
+		# locals must live in frames.
+		if tick_budget is not None:
+			if not isinstance(tick_budget, int) or tick_budget <= 0:
+				raise Exception(f"Error: The tick budget must be a positive integer, got {tick_budget!r}.")
+			if not frames:
+				raise Exception("Error: A tick budget needs frames.")
+		self.tick_budget = tick_budget
+
+		# Generated names and node ids. Every graph of this translation draws from it, so they only depend on the seed
+		self.random_util = RandomUtil(seed)
+
+		# Per pass trace events, disabled unless a tracer with enabled passes is given
+		self.tracer = tracer if tracer is not None else Tracer()
+
+		# Per pass wall time and counters, always collected
+		self.stats = TranslationStats()
   
 		# Graphs
-		self.IR_graph = IRGraph() 
+		self.IR_graph = IRGraph(random_util=self.random_util, tracer=self.tracer) 
 		self.exeuction_IR_graphs = [self.IR_graph]
 	
 		# Links
 		self.links = []
+		# Yield nodes of the tick budget, resumable like async links
+		self.yields = []
+		# Execution graph to exit, memoized by graph_exit
+		self.graph_exits = {}
 
 		# Main function tracking	
 		self.main_function_name = None
 		self.function_count = 0
 		self.inside_main_function = False
+		# Chunk-level statements before and after the main function, emitted at the top level of the generated script
+		self.chunk_statements_before = []
+		self.chunk_statements_after = []
   
 		# Variable reference tracking
 		self.variable_refs = {}
@@ -93,9 +245,9 @@ class Translator:
  		- Separate async statements:
 		-- Find async node (x), add children of (x) to new IR graph, replace child of (x) with link to new IR graph
 		- Linearize Branches:
-		-- Find node (x) with a branch child, add other children of (x) to a new IR graph, then append it to the end 
-		of each execution path of the branch child as a link node.
-		-- If there is no else statement present, create one
+		-- Find node (x) with a branch child whose block contains an async node, add other children of (x) to a new
+		IR graph, the join graph of the branch. Every execution path of the branch continues in it.
+		-- If there is no else statement present, the path where no conditional is true continues in it too
 
 	'''
 	'''
@@ -105,7 +257,8 @@ class Translator:
 		-- 1a. (Build) Travsering from the root, find all regular, conditional and loop nodes and add them to the graph linearly 
 		(without going into the branches or loops)
 		-- 1b. (Expand) For each node with a block, enter the block
-  		-- 1c. Mark whether the block contains an async call/assignment
+  		-- 1c. Mark whether the block contains an async call/assignment (subtree summaries, computed bottom-up once
+		the graph is expanded)
 		-- 1d. goto 1a
 	x. Check for recusion
 		- Make sure no functions recurse. If they do, then throw an error
@@ -119,8 +272,8 @@ class Translator:
 		- If there is no else statement present, create one and put the post execution tree under the new else node
 	x. Construct Execution Graphs: 
 		- Linearize:
-		-- Find node (x) with a branch child, add other children of (x) to a new IR graph, then append it to the end 
-		of each execution path of the branch child as a link node.
+		-- Find node (x) with a branch child that contains an async node, add other children of (x) to a new IR graph,
+		the join graph of the branch. Branches without async nodes stay inline.
 		- Separate:
 		-- Find async node (x), add children of (x) to new IR graph, replace child of (x) with link to new IR graph
 	x. Extract functions:
@@ -133,17 +286,44 @@ class Translator:
 		- Secrete the full lua AST
 	'''
 	def translate(self):
+		self.run_passes()
+
+		logging.info(f"Constructing new AST")
+		self.begin_pass('construct_ast')
+		lua_chunk = self.construct_ast()
+		self.end_passes()
+		return lua_chunk
+
+	'''
+		Same as translate, but the generated Lua is written to a file-like sink one top-level statement at a time,
+		instead of being built into a single AST first. Every pass still runs, and the IR stays in memory, before the
+		first statement is written; only the output AST and source are never held whole. The output is identical to
+		translating and printing the AST.
+	'''
+	def translate_to(self, sink):
+		self.run_passes()
+
+		logging.info(f"Writing generated Lua")
+		self.begin_pass('construct_ast')
+		self.emit_lua_source(sink)
+		self.end_passes()
+
+	def run_passes(self):
 		# Stage 1
 		# Build the graph tree 
   
 		logging.info(f"Building IR graph from Lua source")
+		self.begin_pass('build')
 		self.build_IR_graph(self.source_lua_root_node)
 		if self.render_visual_graph: 
 			render_visual_graph(output_graph_name="IR_graph", root_nodes=[self.IR_graph.root_node])
 
 
 		logging.info(f"Expanding IR graph")
+		self.begin_pass('expand')
 		self.expand_nodes(self.IR_graph.root_node)
+		# Async reachability, read by linearizing
+		self.IR_graph.root_node.subtree_summary()
 		if self.render_visual_graph: 
 			render_visual_graph(output_graph_name="Expanded_IR_graph", root_nodes=[self.IR_graph.root_node])
 
@@ -165,6 +345,7 @@ class Translator:
 		# 	render_visual_graph(output_graph_name="Modified_assignments_IR_graph", root_nodes=[self.IR_graph.root_node])
 		
 		logging.info(f"Linearizing branches into exeuction graphs")
+		self.begin_pass('linearize')
 		self.linearize_branches()
 		if self.render_visual_graph: 
 			root_nodes = [graph.root_node for graph in self.exeuction_IR_graphs]
@@ -172,6 +353,7 @@ class Translator:
 			render_visual_graph(output_graph_name="linearized_branches_IR_graphs", root_nodes=root_nodes)
 		
 		logging.info(f"Separating async statements into exeuction graphs")
+		self.begin_pass('separate_async')
 		self.separate_async_statements()
 		if self.render_visual_graph: 
 			root_nodes = [graph.root_node for graph in self.exeuction_IR_graphs]
@@ -179,28 +361,62 @@ class Translator:
 			render_visual_graph(output_graph_name="seperated_async_IR_graphs", root_nodes=root_nodes)
   
 
+		logging.info(f"Slicing exeuction graphs to the tick budget")
+		self.begin_pass('slice')
+		if self.tick_budget is not None:
+			self.slice_exeuction_graphs()
+
 		logging.info(f"Inserting event pointers")
+		self.begin_pass('event_pointers')
 		self.insert_event_pointers()
 		if self.render_visual_graph: 
 			root_nodes = [graph.root_node for graph in self.exeuction_IR_graphs]
 			# root_nodes.append(self.IR_graph.root_node)
 			render_visual_graph(output_graph_name="event_ptrs_IR_graphs", root_nodes=root_nodes)
-  
-	
-		logging.info(f"Constructing new AST")
-		self.construct_ast()
+
+		logging.info(f"Merging identical exeuction graphs")
+		self.begin_pass('dedupe')
+		self.dedupe_exeuction_graphs()
+		if self.render_visual_graph: 
+			root_nodes = [graph.root_node for graph in self.exeuction_IR_graphs]
+			render_visual_graph(output_graph_name="deduped_IR_graphs", root_nodes=root_nodes)
+
+	def begin_pass(self, pass_name):
+		self.tracer.begin(pass_name)
+		self.stats.begin(pass_name)
+
+	def end_passes(self):
+		self.tracer.begin(None)
+		self.stats.end()
 
 
 	def build_IR_graph(self, node):
+		# Only the main function is translated, the statements around it are kept as they are
+		if isinstance(node, astnodes.Chunk):
+			statements = node.body.body
+			function_indices = [index for index, statement in enumerate(statements) if isinstance(statement, astnodes.Function)]
+			if len(function_indices) > 1:
+				raise Exception("Error: More than one function defined. Scripts should only contain one function definition.")
+			if function_indices:
+				(function_index,) = function_indices
+				self.chunk_statements_before = statements[:function_index]
+				self.chunk_statements_after = statements[function_index + 1:]
+				node = statements[function_index]
+
 		# First collect regular/async statements, branches and loops (without entering)
-		logging.debug("Collecting nodes")	
 		self.visit(node)
 
 
 	# Enter the bodies of if statements and loops
 	def expand_nodes(self, node):
-		print(node)
-		print(type(node))
+		# Nodes added while expanding are reached by the same walk
+		for graph_node in self.IR_graph.preorder(node):
+			self.expand_node(graph_node)
+
+	def expand_node(self, node):
+		self.stats.current.nodes_visited += 1
+		if self.tracer.active:
+			self.tracer.emit("expand", node)
 		# If the node is a branch, expand the children
 		if isinstance(node, GeneratedBranchIRGraphNode):
 			# The lua node for the branch holds the "if" lua node
@@ -211,12 +427,14 @@ class Translator:
 			conditional_nodes = [ConditionalIRGraphNode(lua_node=if_node)]
 			lookahead_node = if_node.orelse
 			while(isinstance(lookahead_node, astnodes.ElseIf)):
-				logging.debug(f"Found ElseIf")
+				if self.tracer.active:
+					self.tracer.emit("found_elseif", node, lookahead_node)
 				conditional_nodes.append(ConditionalIRGraphNode(lua_node=lookahead_node))
 				lookahead_node = lookahead_node.orelse
 			if(lookahead_node is not None):
 				# Else statement is of type list<Statement>
-				logging.debug(f"Found Else")
+				if self.tracer.active:
+					self.tracer.emit("found_else", node)
 				node.else_statement_present = True
 				conditional_nodes.append(ConditionalIRGraphNode(lua_node=lookahead_node, name="Else"))
 
@@ -250,10 +468,6 @@ class Translator:
 				self.IR_graph.add_node(GeneratedBlockIRGraphNode())
 				self.visit(node.lua_node.body)
 
-		# Expand each child	
-		for child in node.children:
-			self.expand_nodes(child)
-
 	
 
 	# def modify_assignments(self, node):
@@ -288,145 +502,352 @@ class Translator:
 	# 	for child in node.children:
 	# 		self.update_references(child)
 
+	'''
+		Branches and loops are linearized in postorder, so inner and later ones are linearized before the ones that
+		contain them. A branch only moves its post execution tree to a new graph, its join graph; the paths through the
+		branch are linked to it when code is generated, so each branch is rewritten once whatever the size of its block.
+		Only branches and loops with an async node in their block are linearized. The others stay inline and are
+		generated as plain Lua statements.
+	'''
 	def linearize_branches(self):
-		traversal_order = self.IR_graph.postorder(self.IR_graph.root_node)
-  
-		for node in traversal_order:
-   			# Check if node have branch as children
-			branch_present = False
-			branch_node = None
-			for child in node.children:
-				if isinstance(child, GeneratedBranchIRGraphNode):
-					branch_present = True
-					branch_node = child
-	
+		control_nodes = []
+		for node in self.IR_graph.postorder():
+			self.stats.current.nodes_visited += 1
+			if isinstance(node, (GeneratedBranchIRGraphNode, LoopIRGraphNode)):
+				control_nodes.append(node)
+
+		for node in control_nodes:
+			if isinstance(node, LoopIRGraphNode):
+				self.lower_loop(node)
+			else:
+				self.linearize_branch(node)
 
-			# The post exeuction tree are nodes that execute after the nodes in the branch
-			post_exeuction_tree = None
-
-			if branch_present:
-				block_node = None
-				# Find the post exeuction tree (if present)
-				logging.debug(f"Found Branch {branch_node.id}")
-				for child in branch_node.children:
-					if not isinstance(child, GeneratedBlockIRGraphNode):
-						post_exeuction_tree = child
-					elif isinstance(child, GeneratedBlockIRGraphNode):
-						block_node = child
-				
-				# Continue if there is no post exeuction tree (not present or branch has already been linearized)
-				if post_exeuction_tree is None:
-					continue
- 
-				logging.debug(f"Found post execution tree {post_exeuction_tree.name} {post_exeuction_tree.id}")
-				
-  
-				# '''
-				# Modify Branches:
-				# - Find Nonterminal Conditional Branches (NCBs), that is branches that do not contain an else statement.
-				# 	-- When linearizing, code that is executed after the if statement is appended to each conditional in the branch. This creates a problem in the following case:
-				# 	* The code is linearized
-				# 	* There is code after the branch (post exeuction tree)
-				# 	* The branch does not contain an else statement
-				# 	* All conditionals of the branch evaluate to false
-				# 	The linearized post exeuction tree will never be executed. We can fix this by copying the tree to a new artificially created
-				# 	'else' conditional node under the NCB. 
-				# '''
-
-				# if not branch_node.else_statement_present:
-				# 	logging.debug(f"Branch {branch_node.id} does not have an else statement, creating one")
-				# 	# Construct a placeholder node
-				# 	placeholder_else_node = GeneratedConditionalElseIRGraphNode()
-				# 	self.IR_graph.pointer = branch_node
-				# 	self.IR_graph.add_node(placeholder_else_node)
-				
-				# Find all leaf nodes, including those inside linked subgraphs
-				leaf_nodes = get_subgraph_leaf_nodes(block_node)
-
-				# TODO: Why was this here?
-				# Remove post_execution_tree from leaf nodes
-				# leaf_nodes = [node for node in leaf_nodes if node is not post_exeuction_tree]
-
-				# Create a new IR graph
-				exeuction_IR_graph = IRGraph()
-
-				# Append a new function as the root node
-				placeholder_function = GeneratedFunctionIRGraphNode(generated_function_name=exeuction_IR_graph.generated_name)
-				exeuction_IR_graph.add_node(placeholder_function)
-				logging.debug(f"Constructed new IR graph with root node {exeuction_IR_graph.root_node.name} {exeuction_IR_graph.root_node.id}")
-
-				# Copy the post execution tree to the new IR graph
-				logging.debug(f"Copying tree from source node {post_exeuction_tree.name} {post_exeuction_tree.id} to graph {exeuction_IR_graph.generated_name[4:10]} at parent node {exeuction_IR_graph.pointer.name} {exeuction_IR_graph.pointer.id}")
-				copy_tree(src_node=post_exeuction_tree, dst_graph=exeuction_IR_graph, dst_node=exeuction_IR_graph.pointer)
-				self.exeuction_IR_graphs.append(exeuction_IR_graph)	
-
-				# Add a link to thew new IR graph to each of the leaf nodes
-				for leaf_node in leaf_nodes:
-					# Find which IR graph the leaf node belongs to
-					IR_graph = leaf_node.IR_graph
-					# Add link to execution graph
-					IR_graph.pointer = leaf_node
-					logging.debug(f"Adding link to leaf node {leaf_node.name} {leaf_node.id}")
-					link_node = GeneratedLinkIRGraphNode(exeuction_IR_graph, async_link=False)
-					IR_graph.add_node(link_node)
-	 
-					# Track link node
-					self.links.append((link_node, exeuction_IR_graph))
-   
-				# Remove the post execution tree from the main IR graph
-				self.IR_graph.remove_node(post_exeuction_tree)
-
-				# Reset the traversal order
-				traversal_order = self.IR_graph.postorder(self.IR_graph.root_node)
+	'''
+		Returns the block node and the post exeuction tree (nodes that execute after the nodes in the branch) of a branch
+	'''
+	def split_branch_children(self, branch_node):
+		block_node = None
+		post_exeuction_tree = None
+		for child in branch_node.children:
+			if isinstance(child, GeneratedBlockIRGraphNode):
+				block_node = child
+			else:
+				post_exeuction_tree = child
+		return block_node, post_exeuction_tree
+
+	def linearize_branch(self, branch_node):
+		# Find the post exeuction tree (if present)
+		block_node, post_exeuction_tree = self.split_branch_children(branch_node)
+		
+		# Nothing to do if there is no post exeuction tree (not present or branch has already been linearized)
+		if post_exeuction_tree is None:
+			return
+
+		# Synchronous branches run to completion, the code after them needs no graph of its own
+		if not self.IR_graph.contains_async(block_node):
+			return
+
+		if self.tracer.active:
+			self.tracer.emit("found_post_exeuction_tree", branch_node, post_exeuction_tree)
+
+		# Create a new IR graph
+		exeuction_IR_graph = IRGraph(random_util=self.random_util, tracer=self.tracer)
+		exeuction_IR_graph.origin = branch_node
+
+		# Append a new function as the root node
+		placeholder_function = GeneratedFunctionIRGraphNode(generated_function_name=exeuction_IR_graph.generated_name)
+		exeuction_IR_graph.add_node(placeholder_function)
+
+		# Move the post execution tree out of the main IR graph and into the new IR graph. It becomes the join graph of
+		# the branch: every path through the block continues there, including the path where no conditional is true.
+		if self.tracer.active:
+			self.tracer.emit("move_tree", post_exeuction_tree, exeuction_IR_graph)
+		moved_nodes = move_tree(src_node=post_exeuction_tree, dst_graph=exeuction_IR_graph, dst_node=exeuction_IR_graph.root_node)
+		branch_node.join_graph = exeuction_IR_graph
+		self.exeuction_IR_graphs.append(exeuction_IR_graph)	
+		self.stats.current.nodes_moved += len(moved_nodes)
+		self.stats.current.graphs_created += 1
+
+	'''
+		Lowers a loop with an async node in its body to a re-entrant head graph. The body is moved to the head graph,
+		which tests the loop condition and runs one iteration; running off the end of the body calls the head graph
+		again, a tail call. The code after the loop is moved to the loop's join graph, where the head graph goes once the
+		condition fails and where break statements go. The counter or iterator of the loop is kept in loop state names
+		(frame fields with frames, fields of global otherwise) set when the loop is entered, so an await in the body
+		resumes the same iteration, however many iterations the loop runs, and no table is allocated per iteration.
+	'''
+	def lower_loop(self, loop_node):
+		block_node, post_exeuction_tree = self.split_branch_children(loop_node)
+		if block_node.first_child is None:
+			return
+		# With a tick budget every loop is lowered, so that its iterations can be spread over ticks
+		if not self.IR_graph.contains_async(block_node) and self.tick_budget is None:
+			return
+
+		if self.tracer.active:
+			self.tracer.emit("lower_loop", loop_node)
+
+		if post_exeuction_tree is not None:
+			join_IR_graph = IRGraph(random_util=self.random_util, tracer=self.tracer)
+			join_IR_graph.origin = loop_node
+			join_IR_graph.add_node(GeneratedFunctionIRGraphNode(generated_function_name=join_IR_graph.generated_name))
+			moved_nodes = move_tree(src_node=post_exeuction_tree, dst_graph=join_IR_graph, dst_node=join_IR_graph.root_node)
+			loop_node.join_graph = join_IR_graph
+			self.exeuction_IR_graphs.append(join_IR_graph)
+			self.stats.current.nodes_moved += len(moved_nodes)
+			self.stats.current.graphs_created += 1
+
+		head_IR_graph = IRGraph(random_util=self.random_util, tracer=self.tracer)
+		head_IR_graph.loop_node = loop_node
+		head_IR_graph.add_node(GeneratedFunctionIRGraphNode(generated_function_name=head_IR_graph.generated_name))
+		moved_nodes = move_tree(src_node=block_node.first_child, dst_graph=head_IR_graph, dst_node=head_IR_graph.root_node)
+		loop_node.head_graph = head_IR_graph
+		loop_node.state_name = self.random_util.generate_name('loop')
+		self.exeuction_IR_graphs.append(head_IR_graph)
+		self.stats.current.nodes_moved += len(moved_nodes)
+		self.stats.current.graphs_created += 1
+
+		# The body is gone from the block, the loop itself now stands for its awaits in the loops and branches around it
+		loop_node.contains_async = True
+		loop_node.invalidate_summary()
+
+		# The body runs across functions, so the loop variables are kept in the loop's state like its counter
+		loop_variables = self.loop_variables(loop_node)
+		renames = {target.id: self.construct_loop_state_name(loop_node, f"var_{target.id}").id for target in loop_variables}
+		self.rename_variables(loop_node.lua_node.body, renames)
+		self.rename_variables(loop_variables, renames)
+
+	def loop_variables(self, loop_node):
+		if isinstance(loop_node, FornumIRGraphNode):
+			return [loop_node.lua_node.target]
+		if isinstance(loop_node, ForinIRGraphNode):
+			return list(loop_node.lua_node.targets)
+		return []
 
+	'''
+		Where control goes after a lowered loop ends, by its condition or a break
+	'''
+	def loop_exit(self, loop_node):
+		if loop_node.join_graph is not None:
+			return loop_node.join_graph
+		return self.context_exit(loop_node)
+
+	'''
+		The lowered loop a break in the graph leaves, or None when breaks in the graph are plain Lua breaks
+	'''
+	def graph_loop(self, IR_graph):
+		while IR_graph.loop_node is None:
+			node = IR_graph.origin
+			if node is None:
+				return None
+			while node.parent is not None:
+				if isinstance(node, GeneratedBlockIRGraphNode) and isinstance(node.parent, LoopIRGraphNode):
+					return None
+				node = node.parent
+			IR_graph = node.IR_graph
+		return IR_graph.loop_node
+
+	'''
+		Where control goes after running past a node: the join graph of the innermost linearized branch holding it,
+		FALLTHROUGH inside a loop body, and otherwise the exit of its graph.
+	'''
+	def context_exit(self, node):
+		exit, IR_graph = self.enclosing_exit(node)
+		return exit if IR_graph is None else self.graph_exit(IR_graph)
+
+	'''
+		Where control goes after running off the end of a graph, i.e after running past its origin. Graphs without an
+		origin (the main graph) end the invocation, the head graph of a lowered loop goes on to its next iteration. Exits are memoized: they are fixed once branches are linearized,
+		since splitting a graph gives the new graph the split node as origin.
+	'''
+	def graph_exit(self, IR_graph):
+		visited_graphs = []
+		while id(IR_graph) not in self.graph_exits:
+			visited_graphs.append(IR_graph)
+			if IR_graph.loop_node is not None:
+				exit = IR_graph
+				break
+			if IR_graph.origin is None:
+				exit = END_OF_INVOCATION
+				break
+			exit, IR_graph = self.enclosing_exit(IR_graph.origin)
+			if IR_graph is None:
+				break
+		else:
+			exit = self.graph_exits[id(IR_graph)]
+
+		for visited_graph in visited_graphs:
+			self.graph_exits[id(visited_graph)] = exit
+		return exit
+
+	'''
+		Walks up from a node to the statement it continues after. Returns (exit, None), or (None, graph) when the walk
+		reaches the root of the graph, whose exit applies.
+	'''
+	def enclosing_exit(self, node):
+		while node.parent is not None:
+			parent = node.parent
+			if isinstance(node, ConditionalIRGraphNode):
+				branch_node = parent.parent
+				if branch_node.join_graph is not None:
+					return branch_node.join_graph, None
+				# The branch was not linearized. Branches that await nothing hold no split node, so the walk only gets
+				# here through a branch with no code after it, the last statement of its block
+				node = branch_node
+				continue
+			if isinstance(node, GeneratedBlockIRGraphNode) and isinstance(parent, LoopIRGraphNode):
+				return FALLTHROUGH, None
+			node = parent
+		return None, node.IR_graph
+
+	'''
+		Splits each execution graph at its async nodes in a single pass. Graphs are walked in postorder, so the deepest
+		async node of a chain is split first and the subtree moved out from under a shallower async node never contains
+		an async node that still has to be split. The graphs created here are therefore never walked themselves, and
+		each continuation graph is produced exactly once.
+	'''
 	def separate_async_statements(self):
-		for IR_graph in self.exeuction_IR_graphs:
-			traversal_order = IR_graph.postorder(IR_graph.root_node)
-			for node in traversal_order:
-				if isinstance(node, AsyncIRGraphNode):
-				
-					# Continue if async node has no children
-					if not node.children: continue
-		
-					# Node should have only one child
-					if len(node.children) > 1:
-						logging.error("Async node has more than 1 child")
+		for IR_graph in list(self.exeuction_IR_graphs):
+			# Graphs that await nothing are not walked
+			if not IR_graph.contains_async(IR_graph.root_node):
+				continue
+			for node in IR_graph.postorder():
+				self.stats.current.nodes_visited += 1
+				if not isinstance(node, AsyncIRGraphNode):
+					continue
+				# An async node without children still needs a continuation when control goes on to another graph
+				# after it, i.e at the end of the arm of a linearized branch
+				if node.children or isinstance(self.context_exit(node), IRGraph):
+					self.separate_async_statement(IR_graph, node)
+
+	def separate_async_statement(self, IR_graph, async_node):
+		# Node should have only one child
+		if len(async_node.children) > 1:
+			logging.error("Async node has more than 1 child")
+
+		# Create a new IR graph
+		exeuction_IR_graph = IRGraph(random_util=self.random_util, tracer=self.tracer)
+		exeuction_IR_graph.origin = async_node
+
+		# Append a placeholder function to the new graph as the root node
+		placeholder_function = GeneratedFunctionIRGraphNode(generated_function_name=exeuction_IR_graph.generated_name)	
+		exeuction_IR_graph.add_node(placeholder_function)
+
+		# Move the child tree of the async node to the new graph. Without a child tree, the new graph is empty and only
+		# continues at the exit of the async node.
+		if async_node.children:
+			async_node_child = async_node.children[0]
+			moved_nodes = move_tree(src_node=async_node_child, dst_graph=exeuction_IR_graph, dst_node=exeuction_IR_graph.root_node)
+			if self.tracer.active:
+				self.tracer.emit("move_tree", async_node_child, exeuction_IR_graph)
+			self.stats.current.nodes_moved += len(moved_nodes)
+		self.exeuction_IR_graphs.append(exeuction_IR_graph)
+		self.stats.current.graphs_created += 1
+
+		# Add a link from the async node's graph to the new IR graph
+		previous_pointer = IR_graph.pointer
+		IR_graph.pointer = async_node
+		link_node = GeneratedLinkIRGraphNode(exeuction_IR_graph, async_link=True)
+		IR_graph.add_node(link_node)
+		IR_graph.pointer = previous_pointer
+
+		# Track link node
+		self.links.append((link_node, exeuction_IR_graph))
+		self.stats.current.links_created += 1
 
-					# Get child of async node
-					async_node_child = node.children[0]
+	'''
+		Cuts the exeuction graphs into slices that fit the tick budget. The estimated costs of the statements of a chain
+		are summed, and once a chain has run a budget's worth the rest of it is moved to a new graph, behind a yield
+		node that charges the cost and defers the rest when the budget of the tick is spent. Arms of branches that end
+		their chain are chains of their own, other branches count as one statement. Each iteration of a lowered loop
+		charges the cost of the end of its body and of the loop test before it runs.
+	'''
+	def slice_exeuction_graphs(self):
+		chains = []
+		for IR_graph in list(self.exeuction_IR_graphs):
+			first_node = self.get_next_node(IR_graph.root_node)
+			if first_node is None:
+				continue
+			if IR_graph.loop_node is None:
+				chains.append(first_node)
+				continue
+			yield_node = self.insert_yield(IR_graph.root_node, first_node, 0)
+			leftover_cost = self.slice_chain(self.get_next_node(yield_node.resume_graph.root_node), chains)
+			yield_node.cost = leftover_cost + LOOP_TEST_COST
+			yield_node.name = f"Yield {yield_node.cost}"
+
+		while chains:
+			self.slice_chain(chains.pop(), chains)
 
-					# Create a new IR graph
-					exeuction_IR_graph = IRGraph()
+	'''
+		Slices one chain, queueing the chains of the arms of its last branch. Returns the cost of the chain after its
+		last yield.
+	'''
+	def slice_chain(self, node, chains):
+		cost = 0
+		while node is not None:
+			self.stats.current.nodes_visited += 1
+			cost += self.statement_cost(node, chains)
+			next_node = self.get_next_node(node)
+			# An async link stays with its async node
+			if next_node is not None and cost >= self.tick_budget and not isinstance(next_node, GeneratedLinkIRGraphNode):
+				self.insert_yield(node, next_node, cost)
+				cost = 0
+			node = next_node
+		return cost
+
+	def insert_yield(self, node, next_node, cost):
+		exeuction_IR_graph = IRGraph(random_util=self.random_util, tracer=self.tracer)
+		exeuction_IR_graph.add_node(GeneratedFunctionIRGraphNode(generated_function_name=exeuction_IR_graph.generated_name))
+		moved_nodes = move_tree(src_node=next_node, dst_graph=exeuction_IR_graph, dst_node=exeuction_IR_graph.root_node)
+		self.exeuction_IR_graphs.append(exeuction_IR_graph)
+		self.stats.current.nodes_moved += len(moved_nodes)
+		self.stats.current.graphs_created += 1
+
+		yield_node = GeneratedYieldIRGraphNode(cost, exeuction_IR_graph)
+		node.IR_graph.pointer = node
+		node.IR_graph.add_node(yield_node)
+		self.yields.append(yield_node)
+		exeuction_IR_graph.origin = yield_node
+		if self.tracer.active:
+			self.tracer.emit("yield", node, exeuction_IR_graph)
+		return yield_node
+
+	def statement_cost(self, node, chains):
+		if isinstance(node, GeneratedBranchIRGraphNode):
+			conditional_nodes = self.get_block_node(node).children
+			if self.get_next_node(node) is None:
+				for conditional_node in conditional_nodes:
+					if conditional_node.first_child is not None:
+						chains.append(conditional_node.first_child)
+				return sum(self.node_cost(conditional_node) for conditional_node in conditional_nodes)
+			return sum(self.node_cost(block_node) for block_node in self.IR_graph.preorder(self.get_block_node(node)))
+		return self.node_cost(node)
 
-					# Append a placeholder function to the new graph as the root node
-					placeholder_function = GeneratedFunctionIRGraphNode(generated_function_name=exeuction_IR_graph.generated_name)	
-					exeuction_IR_graph.add_node(placeholder_function)
-		
-					# Copy the child tree of the async node to the new graph			
-					copy_tree(src_node=async_node_child, dst_graph=exeuction_IR_graph, dst_node=exeuction_IR_graph.pointer)
-					logging.debug(f"Constructed new IR graph with root node {exeuction_IR_graph.root_node.name} {exeuction_IR_graph.root_node.id}")
-					self.exeuction_IR_graphs.append(exeuction_IR_graph)
-		
-					# Remove async node children from main graph
-					self.IR_graph.remove_node(async_node_child)
-		
-					# Add a link from the main graph to the new IR graph
-					previous_pointer = self.IR_graph.pointer
-					self.IR_graph.pointer = node
-					link_node = GeneratedLinkIRGraphNode(exeuction_IR_graph, async_link=True)
-					self.IR_graph.add_node(link_node)
-					self.IR_graph.pointer = previous_pointer
-		
-					# Track link node
-					self.links.append((link_node, exeuction_IR_graph))
-		
-					# Reset traversal order
-					traversal_order = self.IR_graph.postorder(self.IR_graph.root_node)
+	'''
+		Estimated cost of a node on its own. Loops and conditionals cost their headers and tests.
+	'''
+	def node_cost(self, node):
+		lua_node = node.lua_node
+		if isinstance(node, RegularIRGraphNode):
+			return node.estimated_cost()
+		if isinstance(node, ConditionalIRGraphNode):
+			return estimate_cost(lua_node.test) if isinstance(lua_node, (astnodes.If, astnodes.ElseIf)) else 0
+		if isinstance(node, (AsyncIRGraphNode, ReturnIRGraphNode)):
+			return estimate_cost(lua_node)
+		if isinstance(node, FornumIRGraphNode):
+			return estimate_cost([lua_node.start, lua_node.stop, lua_node.step])
+		if isinstance(node, ForinIRGraphNode):
+			return estimate_cost(lua_node.iter)
+		if isinstance(node, (WhileIRGraphNode, RepeatIRGraphNode)):
+			return estimate_cost(lua_node.test)
+		return 0
 
 	def insert_event_pointers(self):
 		for IR_graph in self.exeuction_IR_graphs:
 			traversal_order = IR_graph.preorder(IR_graph.root_node)
 			for node in traversal_order:
+				self.stats.current.nodes_visited += 1
 				if isinstance(node, GeneratedLinkIRGraphNode):
 					if node.async_link:
 						# Create a new GeneratedSetEventPointerNode with pointer equal to the generated link name
@@ -440,47 +861,214 @@ class Translator:
 
 						if parent_node and grandparent_node:
 							# Insert the GeneratedSetEventPointerNode between the parent and the GeneratedLinkIRGraphNode
-							self.IR_graph.insert_between_nodes(grandparent_node, parent_node, set_event_pointer_node)
-				
-							# Reset traversal order
-							traversal_order = self.IR_graph.preorder(self.IR_graph.root_node)
+							IR_graph.insert_between_nodes(grandparent_node, parent_node, set_event_pointer_node)
+
+
+	'''
+		Hash-conses the execution graphs: graphs with the same statements, continuing in the same graphs, are merged into
+		one, and graphs that only continue in another graph are replaced by it. Links, join graphs and exits are
+		retargeted to the graph that is kept, and the links of the graphs that are dropped (with their events) go away
+		with them. Async links that resume the same graph then share one event.
+
+		A graph's key depends on the graphs it continues in, so graphs are keyed after them. A link back to a graph that
+		is still being keyed (a cycle) keys on that graph itself, which only prevents merges.
+	'''
+	def dedupe_exeuction_graphs(self):
+		linked_graphs = {link.generated_link_name: graph for link, graph in self.links}
+		representatives = {}
+		graphs_by_key = {}
+		statement_keys = {}
+
+		for exeuction_IR_graph in self.exeuction_IR_graphs:
+			stack = [(exeuction_IR_graph, False)]
+			in_progress = set()
+			while stack:
+				graph, next_graphs_keyed = stack.pop()
+				if id(graph) in representatives:
+					continue
+				if not next_graphs_keyed:
+					in_progress.add(id(graph))
+					stack.append((graph, True))
+					for next_graph in self.next_graphs(graph):
+						if id(next_graph) not in in_progress:
+							stack.append((next_graph, False))
+					continue
 
+				key = self.exeuction_graph_key(graph, representatives, linked_graphs, statement_keys)
+				if isinstance(key, IRGraph):
+					# Only continues in another graph
+					representatives[id(graph)] = key
+				else:
+					representatives[id(graph)] = graphs_by_key.setdefault(key, graph)
+				in_progress.discard(id(graph))
+
+		kept_graphs = [graph for graph in self.exeuction_IR_graphs if representatives[id(graph)] is graph]
+		self.stats.current.graphs_merged += len(self.exeuction_IR_graphs) - len(kept_graphs)
+		kept_graph_ids = {id(graph) for graph in kept_graphs}
+
+		links = []
+		event_links = {}
+		pointers = {}
+		for link, graph in self.links:
+			if id(link.IR_graph) not in kept_graph_ids:
+				continue
+			link.linked_graph = representatives[id(graph)]
+			if link.async_link:
+				event_link = event_links.setdefault(id(link.linked_graph), link)
+				if event_link is not link:
+					pointers[link.generated_link_name] = event_link.generated_link_name
+					continue
+			links.append((link, link.linked_graph))
+		self.links = links
+		self.yields = [yield_node for yield_node in self.yields if id(yield_node.IR_graph) in kept_graph_ids]
+		self.exeuction_IR_graphs = kept_graphs
+
+		for graph_id, exit in self.graph_exits.items():
+			if isinstance(exit, IRGraph):
+				self.graph_exits[graph_id] = representatives[id(exit)]
+
+		for graph in kept_graphs:
+			for node in graph.preorder():
+				if isinstance(node, (GeneratedBranchIRGraphNode, LoopIRGraphNode)) and node.join_graph is not None:
+					node.join_graph = representatives[id(node.join_graph)]
+				elif isinstance(node, GeneratedYieldIRGraphNode):
+					node.resume_graph = representatives[id(node.resume_graph)]
+				elif isinstance(node, GeneratedSetEventPointerNode):
+					node.pointer = pointers.get(node.pointer, node.pointer)
+
+	'''
+		Graphs a graph continues in: the graphs it links to, the join graphs of its branches, the head and join graphs
+		of its lowered loops, the resume graphs of its yields and its exit
+	'''
+	def next_graphs(self, graph):
+		for node in graph.preorder():
+			if isinstance(node, GeneratedLinkIRGraphNode):
+				yield node.linked_graph
+			elif isinstance(node, GeneratedBranchIRGraphNode) and node.join_graph is not None:
+				yield node.join_graph
+			elif isinstance(node, LoopIRGraphNode) and node.head_graph is not None:
+				yield node.head_graph
+				if node.join_graph is not None:
+					yield node.join_graph
+			elif isinstance(node, GeneratedYieldIRGraphNode):
+				yield node.resume_graph
+		exit = self.graph_exit(graph)
+		if isinstance(exit, IRGraph):
+			yield exit
+
+	'''
+		Returns the structural key of a graph, or, for a graph whose body only continues in another graph (it is empty,
+		or a single call), that graph. The main graph is never merged.
+	'''
+	def exeuction_graph_key(self, graph, representatives, linked_graphs, statement_keys):
+		def representative(next_graph):
+			return representatives.get(id(next_graph), next_graph)
+
+		root_node = graph.root_node
+		if isinstance(root_node, FunctionIRGraphNode):
+			return ('main', id(graph))
+
+		exit = self.graph_exit(graph)
+		body = root_node.children
+		# Going on to a repeat loop's head graph checks its test, so a graph that does only that is not the head graph
+		if not body and isinstance(exit, IRGraph) and not isinstance(exit.loop_node, RepeatIRGraphNode):
+			return representative(exit)
+		if len(body) == 1 and isinstance(body[0], GeneratedLinkIRGraphNode) and not body[0].async_link and not body[0].children:
+			return representative(body[0].linked_graph)
+
+		key = [id(representative(exit)) if isinstance(exit, IRGraph) else exit]
+		for node in graph.preorder():
+			self.stats.current.nodes_visited += 1
+			if node is root_node:
+				node_key = ()
+			elif isinstance(node, GeneratedLinkIRGraphNode):
+				node_key = (node.async_link, id(representative(node.linked_graph)))
+			elif isinstance(node, GeneratedSetEventPointerNode):
+				node_key = (id(representative(linked_graphs[node.pointer])),)
+			elif isinstance(node, GeneratedBranchIRGraphNode):
+				node_key = (id(representative(node.join_graph)) if node.join_graph is not None else None,)
+			elif isinstance(node, LoopIRGraphNode) and node.head_graph is not None:
+				# Head graphs keep the state names of their loop, so they are never merged
+				node_key = (id(node.head_graph),)
+			elif isinstance(node, GeneratedYieldIRGraphNode):
+				node_key = (node.cost, id(representative(node.resume_graph)))
+			else:
+				node_key = statement_keys.get(id(node))
+				if node_key is None:
+					node_key = statement_keys[id(node)] = self.statement_key(node)
+			key.append((type(node), node_key, len(node.children)))
+		return tuple(key)
+
+	'''
+		Key of the Lua code a node stands for on its own. Branches, conditionals and loops hold their bodies as IR
+		nodes, so only their tests and headers are part of their key.
+	'''
+	def statement_key(self, node):
+		lua_node = node.lua_node
+		if lua_node is None or isinstance(node, GeneratedBranchIRGraphNode):
+			return ()
+		if isinstance(node, ConditionalIRGraphNode):
+			if isinstance(lua_node, (astnodes.If, astnodes.ElseIf)):
+				return (hash_lua_ast(lua_node.test),)
+			return ('else',)
+		if isinstance(node, FornumIRGraphNode):
+			return tuple(hash_lua_ast(part) for part in (lua_node.target, lua_node.start, lua_node.stop, lua_node.step))
+		if isinstance(node, ForinIRGraphNode):
+			return (hash_lua_ast(lua_node.targets), hash_lua_ast(lua_node.iter))
+		if isinstance(node, (WhileIRGraphNode, RepeatIRGraphNode)):
+			return (hash_lua_ast(lua_node.test),)
+		return (hash_lua_ast(lua_node),)
 
 	def construct_ast(self):
-		script_body = []	
+		script_body = list(self.construct_lua_nodes())
 		script_block_node = astnodes.Block(body=script_body)
 		script_chunk_node = astnodes.Chunk(body=script_block_node)
+		return script_chunk_node
+
+	'''
+		Yields the top-level statements of the generated script in order: the event name table and the event
+		registrations (or the dispatcher registration), one function per execution graph, then the event pointer table.
+		Chunk-level statements of the source come before the functions and after the pointer table, on the same side of
+		the main function as in the source.
+		The pointer table holds the functions themselves, so it comes after they are defined. Each function is only
+		built when it is reached. With integer state ids, the script first reserves its range of states.
+	'''
+	def construct_lua_nodes(self):
+		self.number_states()
 
 		# Build headers
-		event_ptr_nodes = self.construct_event_ptr_assignment_nodes()
-		event_name_nodes = self.construct_event_name_assignment_nodes()
-		event_registration_nodes = self.construct_event_registration_nodes()
-		script_body.extend(event_ptr_nodes)
-		script_body.extend(event_name_nodes)
-		script_body.extend(event_registration_nodes)
-   
+		if self.state_ids == 'integers' and self.state_numbers:
+			yield from self.construct_state_range_nodes()
+		if self.frames:
+			yield from self.construct_frame_pool_nodes()
+		if self.tick_budget is not None:
+			yield from self.construct_scheduler_nodes()
+		if self.event_mode == 'dispatcher':
+			if any(link.async_link for link, graph in self.links):
+				yield self.construct_dispatcher_registration_node()
+		else:
+			yield from self.construct_event_name_assignment_nodes()
+			yield from self.construct_event_registration_nodes()
+
+		yield from self.chunk_statements_before
+
 		# Build functions from IR graph
 		# 1 function per graph
-		function_nodes = []
 		for exeuction_IR_graph in self.exeuction_IR_graphs:
-			function_node = None
-			function_body = []
-			for node in exeuction_IR_graph.preorder():
-				if isinstance(node, RegularIRGraphNode):
-					if isinstance(node, FunctionIRGraphNode):
-						function_node = \
-						astnodes.Function(
-							name=node.lua_node.name,
-							args=node.lua_node.args
-	   					)
-      
-      
-					function_body.append(node.lua_node)
-				if isinstance(node, GeneratedIRGraphNode):
-					print(type(node))
-				else:
-					print(type(node))
+			yield self.construct_function_lua_node(exeuction_IR_graph)
 
+		yield from self.construct_event_ptr_assignment_nodes()
+		yield from self.chunk_statements_after
+
+	'''
+		Prints each top-level statement on its own (in a chunk of its own, so it is indented like a top-level
+		statement) and writes it to the sink, so only one statement's AST and source are held at a time.
+	'''
+	def emit_lua_source(self, sink):
+		separator = ''
+		for lua_node in self.construct_lua_nodes():
+			sink.write(separator + ast.to_lua_source(astnodes.Chunk(body=astnodes.Block(body=[lua_node]))))
+			separator = '\n'
 
 	'''
 	################################################
@@ -500,23 +1088,20 @@ class Translator:
  	'''
 	def construct_event_ptr_assignment_nodes(self):
 		event_ptr_assignment_nodes = []
-		for link, graph in self.links:
-			if link.async_link:
-				event_ptr_assignment_node = \
-					astnodes.Assign(
-					targets=[
-						astnodes.Index(
-							idx=astnodes.String(
-								s=link.generated_link_name
-							),
-							value=astnodes.Name(EVENT_PTR_TABLE_NAME),
-							notation=astnodes.IndexNotation.SQUARE,
-						)
-					],
-					values=[astnodes.Name(graph.root_node.generated_function_name)],
-				)
+		for state_name, graph in self.resumable_states():
+			event_ptr_assignment_node = \
+				astnodes.Assign(
+				targets=[
+					astnodes.Index(
+						idx=self.construct_state_key(state_name),
+						value=astnodes.Name(EVENT_PTR_TABLE_NAME),
+						notation=astnodes.IndexNotation.SQUARE,
+					)
+				],
+				values=[astnodes.Name(graph.root_node.generated_function_name)],
+			)
 
-				event_ptr_assignment_nodes.append(event_ptr_assignment_node)
+			event_ptr_assignment_nodes.append(event_ptr_assignment_node)
 		return event_ptr_assignment_nodes
 
 	'''
@@ -532,9 +1117,7 @@ class Translator:
 					astnodes.Assign(
 					targets=[
 						astnodes.Index(
-							idx=astnodes.String(
-								s=link.generated_link_name
-							),
+							idx=self.construct_state_key(link.generated_link_name),
 							value=astnodes.Name(EVENT_NAME_TABLE_NAME), 
 							notation=astnodes.IndexNotation.SQUARE,
 						)
@@ -551,8 +1134,8 @@ class Translator:
 
 	'''
 		Registers the functions with the event bus i.e
-		script.on_event(global.events['A_event'], function () A() end)
-		script.on_event(global.events['B_event'], function () B() end)
+		script.on_event(global.event_names['A_event'], function () A() end)
+		script.on_event(global.event_names['B_event'], function () B() end)
  	'''
 	def construct_event_registration_nodes(self):
 		event_registration_nodes = []
@@ -561,11 +1144,11 @@ class Translator:
 			if link.async_link:  
 				# We use an anonymous function in Lua for this
 				func_body = astnodes.AnonymousFunction(
-					args=[], 
+					args=[astnodes.Name('event')] if self.frames else [], 
 					body=[
 						astnodes.Call(
 							func=astnodes.Name(graph.root_node.generated_function_name),
-							args=[]
+							args=[astnodes.Name(f"event.{FRAME_NAME}")] if self.frames else []
 						)
 					]
 				)
@@ -575,10 +1158,8 @@ class Translator:
 						func=astnodes.Name(REGISTER_EVENT_FUNCTION_NAME),
 						args=[
 							astnodes.Index(
-								idx=astnodes.String(
-									s=graph.root_node.generated_function_name
-								),
-								value=astnodes.Name("global.events"), #TODO: global.events???
+								idx=self.construct_state_key(link.generated_link_name),
+								value=astnodes.Name(EVENT_NAME_TABLE_NAME),
 								notation=astnodes.IndexNotation.SQUARE,
 							),
 							func_body
@@ -591,20 +1172,644 @@ class Translator:
 
 
 	'''
+		Registers the shared dispatcher, once for all the scripts loaded in the game i.e
+		if not fsm_dispatch_event then
+			fsm_dispatch_event = script.generate_event_name()
+			script.on_event(fsm_dispatch_event, function (event) global.event_ptrs[event.event_ptr](event.frame) end)
+		end
+		The runtime raises fsm_dispatch_event with event_ptr set to global.current_event_ptr (or, for frames, to the
+		pc of global.current_frame, with the frame in the event data). Scripts without frames ignore the argument, so
+		scripts of both kinds can share the handler.
+ 	'''
+	def construct_dispatcher_registration_node(self):
+		dispatch_node = astnodes.Call(
+			func=astnodes.Index(
+				idx=astnodes.Name(f"event.{DISPATCH_EVENT_PTR_FIELD}"),
+				value=astnodes.Name(EVENT_PTR_TABLE_NAME),
+				notation=astnodes.IndexNotation.SQUARE,
+			),
+			args=[astnodes.Name(f"event.{FRAME_NAME}")]
+		)
+
+		handler_node = astnodes.AnonymousFunction(
+			args=[astnodes.Name('event')],
+			body=astnodes.Block(body=[dispatch_node])
+		)
+
+		return astnodes.If(
+			test=astnodes.ULNotOp(operand=astnodes.Name(DISPATCH_EVENT_NAME)),
+			body=astnodes.Block(body=[
+				astnodes.Assign(
+					targets=[astnodes.Name(DISPATCH_EVENT_NAME)],
+					values=[astnodes.Call(func=astnodes.Name(GENERATE_EVENT_NAME_FUNCTION_NAME), args=[])],
+				),
+				astnodes.Call(
+					func=astnodes.Name(REGISTER_EVENT_FUNCTION_NAME),
+					args=[astnodes.Name(DISPATCH_EVENT_NAME), handler_node]
+				),
+			]),
+			orelse=None,
+		)
+
+	'''
+		Maps each async link (and yield) to the name of the function it resumes. Returned alongside the generated code
+		so callers (and cached translations) can inspect the event table without parsing the Lua.
+	'''
+	def construct_event_table(self):
+		return {
+			state_name: graph.root_node.generated_function_name
+			for state_name, graph in self.resumable_states()
+		}
+
+	'''
+	################################################
+		FUNCTIONS
+	################################################
+	'''
+	'''
+		Constructs the function for an execution graph. The main graph keeps the signature of the source function,
+		generated graphs become argument-less functions named after the graph.
+	'''
+	def construct_function_lua_node(self, exeuction_IR_graph):
+		root_node = exeuction_IR_graph.root_node
+		prologue = []
+		if isinstance(root_node, FunctionIRGraphNode):
+			name = root_node.lua_node.name
+			args = root_node.lua_node.args
+			if self.frames:
+				prologue = self.construct_frame_prologue_nodes(args)
+		else:
+			name = astnodes.Name(root_node.generated_function_name)
+			args = [astnodes.Name(FRAME_NAME)] if self.frames else []
+
+		body = self.construct_block_lua_nodes(
+			self.get_next_node(root_node),
+			continuation=self.graph_exit(exeuction_IR_graph),
+			loop_node=self.graph_loop(exeuction_IR_graph),
+		)
+		if exeuction_IR_graph.loop_node is not None:
+			body = self.construct_loop_head_lua_nodes(exeuction_IR_graph.loop_node, body)
+		return astnodes.Function(name=name, args=args, body=astnodes.Block(body=prologue + body))
+
+	'''
+		Statements of a block are a chain of nodes, each one the child of the previous. Branches and loops hold their
+		bodies under a GeneratedBlockIRGraphNode, so the next statement is the node's other child.
+	'''
+	def get_next_node(self, node):
+		next_nodes = [child for child in node.children if not isinstance(child, GeneratedBlockIRGraphNode)]
+		if len(next_nodes) > 1:
+			logging.error(f"Node {node.name} {node.id} has more than 1 next statement")
+		return next_nodes[0] if next_nodes else None
+
+	def get_block_node(self, node):
+		for child in node.children:
+			if isinstance(child, GeneratedBlockIRGraphNode):
+				return child
+		return None
+
+	'''
+		continuation is where control goes when the block runs off its end: an execution graph, which is called there,
+		FALLTHROUGH or END_OF_INVOCATION, where the frame is freed (with frames). in_loop tells whether the block is
+		inside a loop body, where the call to a graph is not a tail call since the loop goes on after it. nested tells
+		whether the block is inside a statement, where an async link returns so that nothing after it runs until the
+		event is raised. loop_node is the lowered loop the block is in the body of, if any: its breaks go to the exit
+		of that loop.
+	'''
+	def construct_block_lua_nodes(self, node, continuation=FALLTHROUGH, in_loop=False, nested=False, loop_node=None):
+		body = []
+		last_node = None
+		while node is not None:
+			self.stats.current.nodes_visited += 1
+			if self.frames and isinstance(node, ReturnIRGraphNode):
+				return body + self.construct_frame_return_lua_nodes(node.lua_node)
+			if isinstance(node, BreakIRGraphNode) and loop_node is not None:
+				return body + self.construct_break_lua_nodes(loop_node, in_loop)
+			if isinstance(node, GeneratedBranchIRGraphNode):
+				body.append(self.construct_branch_lua_node(node, in_loop=in_loop, loop_node=loop_node))
+			elif isinstance(node, LoopIRGraphNode) and node.head_graph is not None:
+				# Lowered loops are entered by setting up their state and calling their head graph
+				body.extend(self.construct_loop_entry_lua_nodes(node))
+				return body + self.construct_graph_call_lua_nodes(node.head_graph, in_loop)
+			elif isinstance(node, GeneratedYieldIRGraphNode):
+				return body + self.construct_yield_lua_nodes(node)
+			else:
+				body.extend(self.construct_statement_lua_nodes(node))
+			last_node = node
+			# Nothing after a return or break is reachable (and Lua does not allow it)
+			if isinstance(node, (ReturnIRGraphNode, BreakIRGraphNode)):
+				return body
+			node = self.get_next_node(node)
+
+		if isinstance(last_node, GeneratedLinkIRGraphNode):
+			if last_node.async_link and nested:
+				body.append(astnodes.Return(values=[]))
+			return body
+		# Every path through a linearized branch continues in its join graph
+		if isinstance(last_node, GeneratedBranchIRGraphNode) and last_node.join_graph is not None:
+			return body
+		return body + self.construct_continuation_lua_nodes(continuation, in_loop)
+
+	'''
+		A break in the body of a lowered loop goes to the exit of the loop. When nothing follows the loop the invocation
+		ends there, so the break returns instead of running the rest of the iteration.
+	'''
+	def construct_break_lua_nodes(self, loop_node, in_loop=False):
+		exit = self.loop_exit(loop_node)
+		if exit == END_OF_INVOCATION:
+			return self.construct_continuation_lua_nodes(exit) + [astnodes.Return(values=[])]
+		return self.construct_continuation_lua_nodes(exit, in_loop)
+
+	'''
+		Going on to the head graph of a lowered repeat loop ends an iteration, so the until test is checked there, where
+		the locals of the body are in scope:
+		if t then
+			return f_after()
+		else
+			return f_head()
+		end
+	'''
+	def construct_continuation_lua_nodes(self, continuation, in_loop=False):
+		if isinstance(continuation, IRGraph):
+			call_nodes = self.construct_graph_call_lua_nodes(continuation, in_loop)
+			loop_node = continuation.loop_node
+			if not isinstance(loop_node, RepeatIRGraphNode):
+				return call_nodes
+			exit_nodes = self.construct_continuation_lua_nodes(self.loop_exit(loop_node), in_loop)
+			if not exit_nodes:
+				test = astnodes.ULNotOp(operand=wrap_expression(loop_node.lua_node.test))
+				return [astnodes.If(test=test, body=astnodes.Block(body=call_nodes), orelse=None)]
+			return [astnodes.If(
+				test=loop_node.lua_node.test,
+				body=astnodes.Block(body=exit_nodes),
+				orelse=astnodes.Block(body=call_nodes),
+			)]
+		if continuation == END_OF_INVOCATION and self.frames:
+			return [self.construct_free_frame_node()]
+		return []
+
+	def construct_graph_call_lua_nodes(self, IR_graph, in_loop=False):
+		args = [astnodes.Name(FRAME_NAME)] if self.frames else []
+		call = astnodes.Call(func=astnodes.Name(IR_graph.root_node.generated_function_name), args=args)
+		return [call] if in_loop else [astnodes.Return(values=[call])]
+
+	def construct_statement_lua_nodes(self, node):
+		if isinstance(node, GeneratedBranchIRGraphNode):
+			return [self.construct_branch_lua_node(node)]
+
+		if isinstance(node, LoopIRGraphNode):
+			return [self.construct_loop_lua_node(node)]
+
+		if isinstance(node, GeneratedLinkIRGraphNode):
+			# Async links are followed through the event bus, not called
+			if node.async_link:
+				return []
+			args = [astnodes.Name(FRAME_NAME)] if self.frames else []
+			return [astnodes.Call(func=astnodes.Name(node.linked_graph.root_node.generated_function_name), args=args)]
+
+		if isinstance(node, GeneratedSetEventPointerNode):
+			if self.frames:
+				return self.construct_frame_pointer_assignments(node.pointer)
+			return [self.construct_event_pointer_assignment(node.pointer)]
+
+		if isinstance(node, (GeneratedIRGraphNode, GeneratedBlockIRGraphNode)):
+			return []
+
+		return [node.lua_node]
+
+	'''
+	################################################
+		CONTROL STRUCTURES
+	################################################
+	'''
+	'''
+		Rebuilds the if/elseif/else statement from the conditionals of a branch.
 		Else nodes are list<Statement>
-  	'''
-	def construct_else_lua_node():
-		pass
-		# return astnodes.
- 
-	def construct_global_assign_lua_node():
-		pass
-	
-	def construct_function_lua_node():
-		pass
+	'''
+	def construct_branch_lua_node(self, branch_node, in_loop=False, loop_node=None):
+		conditional_nodes = self.get_block_node(branch_node).children
+		# Arms of a linearized branch continue in its join graph, the arms of other branches fall out of it
+		continuation = branch_node.join_graph if branch_node.join_graph is not None else FALLTHROUGH
+
+		orelse = None
+		# So does the path where no conditional is true
+		if not branch_node.else_statement_present:
+			orelse_body = self.construct_continuation_lua_nodes(continuation, in_loop)
+			if orelse_body:
+				orelse = astnodes.Block(body=orelse_body)
+		for conditional_node in reversed(conditional_nodes):
+			body = astnodes.Block(body=self.construct_block_lua_nodes(conditional_node.first_child, continuation, in_loop, nested=True, loop_node=loop_node))
+			if isinstance(conditional_node.lua_node, astnodes.If):
+				orelse = astnodes.If(test=conditional_node.lua_node.test, body=body, orelse=orelse)
+			elif isinstance(conditional_node.lua_node, astnodes.ElseIf):
+				orelse = astnodes.ElseIf(test=conditional_node.lua_node.test, body=body, orelse=orelse)
+			else:
+				orelse = body
+
+		return orelse
+
+	def construct_loop_lua_node(self, loop_node):
+		lua_node = loop_node.lua_node
+		body = astnodes.Block(body=self.construct_block_lua_nodes(self.get_block_node(loop_node).first_child, in_loop=True, nested=True))
+
+		if isinstance(loop_node, FornumIRGraphNode):
+			return astnodes.Fornum(target=lua_node.target, start=lua_node.start, stop=lua_node.stop, step=lua_node.step, body=body)
+		if isinstance(loop_node, ForinIRGraphNode):
+			return astnodes.Forin(body=body, iter=lua_node.iter, targets=lua_node.targets)
+		if isinstance(loop_node, WhileIRGraphNode):
+			return astnodes.While(test=lua_node.test, body=body)
+		if isinstance(loop_node, RepeatIRGraphNode):
+			return astnodes.Repeat(body=body, test=lua_node.test)
 
-	def construct_event_pointer_assignment():
-		pass
+	'''
+	################################################
+		LOWERED LOOPS
+	################################################
+	'''
+	'''
+		A field of the loop's state i.e frame.loop_x_1_stop, or global.loop_x_1_stop without frames
+	'''
+	def construct_loop_state_name(self, loop_node, field):
+		table_name = FRAME_NAME if self.frames else LOOP_STATE_TABLE_NAME
+		return astnodes.Name(f"{table_name}.{loop_node.state_name}_{field}")
+
+	'''
+		Sets up the state of a lowered loop before its first iteration. Like Lua, the range of a numeric for and the
+		iterator of a generic for are evaluated once:
+		for i = a, b, s do   ->   loop_stop = b  loop_step = s  loop_i = a - s
+		for k, v in e do     ->   loop_f, loop_s, loop_c = e
+	'''
+	def construct_loop_entry_lua_nodes(self, loop_node):
+		lua_node = loop_node.lua_node
+		state = partial(self.construct_loop_state_name, loop_node)
+		if isinstance(loop_node, FornumIRGraphNode):
+			step = self.constant_loop_step(lua_node)
+			if step is None:
+				return [
+					astnodes.Assign(targets=[state('stop'), state('step')], values=[lua_node.stop, lua_node.step]),
+					astnodes.Assign(targets=[state('i')], values=[astnodes.SubOp(left=wrap_expression(lua_node.start), right=state('step'))]),
+				]
+			if isinstance(lua_node.start, astnodes.Number):
+				start = astnodes.Number(n=lua_node.start.n - step)
+			else:
+				start = astnodes.SubOp(left=wrap_expression(lua_node.start), right=astnodes.Number(n=step))
+			return [astnodes.Assign(targets=[state('stop'), state('i')], values=[lua_node.stop, start])]
+		if isinstance(loop_node, ForinIRGraphNode):
+			return [astnodes.Assign(targets=[state('f'), state('s'), state('c')], values=lua_node.iter)]
+		return []
+
+	'''
+		The step of a numeric for, when it is a number literal
+	'''
+	def constant_loop_step(self, lua_node):
+		step = lua_node.step
+		if isinstance(step, astnodes.Number):
+			return step.n
+		if isinstance(step, (int, float)):
+			return step
+		return None
+
+	'''
+		Wraps the body of a lowered loop's head graph in the test of the loop. The loop variables are set from the loop
+		state for the iteration, and when the test fails the loop exits (a repeat loop has no test before its body):
+		loop_i = loop_i + 1
+		if loop_i <= loop_stop then
+			loop_var_i = loop_i
+			...
+		else
+			return f_after()
+		end
+	'''
+	def construct_loop_head_lua_nodes(self, loop_node, body):
+		lua_node = loop_node.lua_node
+		state = partial(self.construct_loop_state_name, loop_node)
+		head = []
+		if isinstance(loop_node, FornumIRGraphNode):
+			step = self.constant_loop_step(lua_node)
+			step_node = astnodes.Number(n=step) if step is not None else state('step')
+			head.append(astnodes.Assign(targets=[state('i')], values=[astnodes.AddOp(left=state('i'), right=step_node)]))
+			if step is None:
+				test = astnodes.OrLoOp(
+					left=astnodes.AndLoOp(
+						left=astnodes.GreaterThanOp(left=state('step'), right=astnodes.Number(n=0)),
+						right=astnodes.LessOrEqThanOp(left=state('i'), right=state('stop')),
+					),
+					right=astnodes.AndLoOp(
+						left=astnodes.LessOrEqThanOp(left=state('step'), right=astnodes.Number(n=0)),
+						right=astnodes.GreaterOrEqThanOp(left=state('i'), right=state('stop')),
+					),
+				)
+			elif step > 0:
+				test = astnodes.LessOrEqThanOp(left=state('i'), right=state('stop'))
+			else:
+				test = astnodes.GreaterOrEqThanOp(left=state('i'), right=state('stop'))
+			body = [self.construct_loop_variable_assignment([lua_node.target], [state('i')])] + body
+		elif isinstance(loop_node, ForinIRGraphNode):
+			head.append(self.construct_loop_variable_assignment(
+				lua_node.targets, [astnodes.Call(func=state('f'), args=[state('s'), state('c')])]
+			))
+			head.append(astnodes.Assign(targets=[state('c')], values=[self.loop_variable_name(lua_node.targets[0])]))
+			test = astnodes.NotEqToOp(left=state('c'), right=astnodes.Nil())
+		elif isinstance(loop_node, WhileIRGraphNode):
+			test = lua_node.test
+		else:
+			# The test of a repeat loop is checked at the end of each iteration, see construct_continuation_lua_nodes
+			return body
+
+		orelse_body = self.construct_continuation_lua_nodes(self.loop_exit(loop_node))
+		orelse = astnodes.Block(body=orelse_body) if orelse_body else None
+		return head + [astnodes.If(test=test, body=astnodes.Block(body=body), orelse=orelse)]
+
+	'''
+		The loop variables are fields of the loop's state, renamed when the loop was lowered
+	'''
+	def construct_loop_variable_assignment(self, targets, values):
+		return astnodes.Assign(targets=[self.loop_variable_name(target) for target in targets], values=values)
+
+	def loop_variable_name(self, target):
+		return astnodes.Name(target.id)
+
+	'''
+	################################################
+		TICK BUDGET
+	################################################
+	'''
+	def construct_scheduler_nodes(self):
+		return ast.parse(SCHEDULER_SOURCE % {'tick_budget': self.tick_budget}).body.body
+
+	'''
+		global.fsm_budget = global.fsm_budget - 40
+		if global.fsm_budget < 0 then
+			fsm_defer('l_resume', frame)
+			return
+		end
+		return f_resume(frame)
+	'''
+	def construct_yield_lua_nodes(self, yield_node):
+		resume_function_name = yield_node.resume_graph.root_node.generated_function_name
+		state_key = self.construct_state_key(yield_node.generated_state_name)
+		return [
+			astnodes.Assign(
+				targets=[astnodes.Name(BUDGET_NAME)],
+				values=[astnodes.SubOp(left=astnodes.Name(BUDGET_NAME), right=astnodes.Number(n=yield_node.cost))],
+			),
+			astnodes.If(
+				test=astnodes.LessThanOp(left=astnodes.Name(BUDGET_NAME), right=astnodes.Number(n=0)),
+				body=astnodes.Block(body=[
+					astnodes.Call(
+						func=astnodes.Name(DEFER_FUNCTION_NAME),
+						args=[state_key, astnodes.Name(FRAME_NAME)],
+					),
+					astnodes.Return(values=[]),
+				]),
+				orelse=None,
+			),
+			astnodes.Return(values=[astnodes.Call(func=astnodes.Name(resume_function_name), args=[astnodes.Name(FRAME_NAME)])]),
+		]
+
+	'''
+		Sets the pointer the async runtime reads to raise the link's event once the awaited call completes i.e
+		global.current_event_ptr = 'A_event'
+	'''
+	def construct_event_pointer_assignment(self, pointer):
+		return astnodes.Assign(
+			targets=[astnodes.Name(CURRENT_EVENT_PTR_NAME)],
+			values=[self.construct_state_key(pointer)],
+		)
+
+	'''
+	################################################
+		STATE IDS
+	################################################
+	'''
+	'''
+		States a saved invocation can resume in, as (state name, graph): async links, then the yields of the tick budget
+	'''
+	def resumable_states(self):
+		for link, graph in self.links:
+			if link.async_link:
+				yield link.generated_link_name, graph
+		for yield_node in self.yields:
+			yield yield_node.generated_state_name, yield_node.resume_graph
+
+	'''
+		Numbers the states 1..n, async links in the order they were created and then yields
+	'''
+	def number_states(self):
+		self.state_numbers = {}
+		for state_name, graph in self.resumable_states():
+			self.state_numbers[state_name] = len(self.state_numbers) + 1
+		self.stats.state_count = len(self.state_numbers)
+
+	'''
+		The key of a state in the event tables and the value of the event pointer. i.e
+		'A_event' or fsm_state_base_x + 1
+	'''
+	def construct_state_key(self, link_name):
+		if self.state_ids == 'names':
+			return astnodes.String(s=link_name)
+		return astnodes.AddOp(left=astnodes.Name(self.state_base_name), right=astnodes.Number(n=self.state_numbers[link_name]))
+
+	@property
+	def state_base_name(self):
+		return f"{STATE_BASE_NAME}_{self.random_util.tag}"
+
+	'''
+		Reserves the states of the script the first time it is loaded, and reads its base back from global on every
+		load after that. The base is cached in a plain Lua global for the state keys.
+	'''
+	def construct_state_range_nodes(self):
+		return ast.parse(STATE_RANGE_SOURCE % {
+			'tag': self.random_util.tag,
+			'state_count': len(self.state_numbers),
+			'state_base_name': self.state_base_name,
+		}).body.body
+
+	'''
+	################################################
+		FRAMES
+	################################################
+	'''
+	'''
+		Defines the frame pool, once for all the scripts loaded in the game
+	'''
+	def construct_frame_pool_nodes(self):
+		return ast.parse(FRAME_POOL_SOURCE).body.body
+
+	'''
+		Takes a frame for the invocation and stores the arguments in it i.e
+		local frame = fsm_alloc_frame()
+		frame.a = a
+	'''
+	def construct_frame_prologue_nodes(self, args):
+		prologue = [
+			astnodes.LocalAssign(
+				targets=[astnodes.Name(FRAME_NAME)],
+				values=[astnodes.Call(func=astnodes.Name(ALLOC_FRAME_FUNCTION_NAME), args=[])],
+			)
+		]
+		for arg in args:
+			if isinstance(arg, astnodes.Name):
+				prologue.append(astnodes.Assign(targets=[astnodes.Name(f"{FRAME_NAME}.{arg.id}")], values=[astnodes.Name(arg.id)]))
+		return prologue
+
+	def construct_free_frame_node(self):
+		return astnodes.Call(func=astnodes.Name(FREE_FRAME_FUNCTION_NAME), args=[astnodes.Name(FRAME_NAME)])
+
+	'''
+		The return values may read the frame, so they are evaluated before it is freed i.e
+		local fsm_return_1, fsm_return_2 = frame.x, f(frame.y)
+		fsm_free_frame(frame)
+		return fsm_return_1, fsm_return_2
+		A call or ... in the last place can return any number of values, those are packed into a table instead.
+	'''
+	def construct_frame_return_lua_nodes(self, return_node):
+		values = return_node.values
+		if not values:
+			return [self.construct_free_frame_node(), return_node]
+		if isinstance(values[-1], (astnodes.Call, astnodes.Invoke, astnodes.Varargs)):
+			results = astnodes.Name(RETURN_VALUE_NAME)
+			return [
+				astnodes.LocalAssign(
+					targets=[results],
+					values=[astnodes.Call(func=astnodes.Name('table.pack'), args=values)],
+				),
+				self.construct_free_frame_node(),
+				astnodes.Return(values=[astnodes.Call(
+					func=astnodes.Name('table.unpack'),
+					args=[astnodes.Name(RETURN_VALUE_NAME), astnodes.Number(1), astnodes.Name(f"{RETURN_VALUE_NAME}.n")],
+				)]),
+			]
+		names = [f"{RETURN_VALUE_NAME}_{index}" for index in range(1, len(values) + 1)]
+		return [
+			astnodes.LocalAssign(targets=[astnodes.Name(name) for name in names], values=values),
+			self.construct_free_frame_node(),
+			astnodes.Return(values=[astnodes.Name(name) for name in names]),
+		]
+
+	'''
+		Sets the program counter of the frame and publishes the frame for the async runtime i.e
+		frame.pc = 'A_event'
+		global.current_frame = frame
+	'''
+	def construct_frame_pointer_assignments(self, pointer):
+		return [
+			astnodes.Assign(
+				targets=[astnodes.Name(f"{FRAME_NAME}.{FRAME_PC_FIELD}")],
+				values=[self.construct_state_key(pointer)],
+			),
+			astnodes.Assign(
+				targets=[astnodes.Name(CURRENT_FRAME_NAME)],
+				values=[astnodes.Name(FRAME_NAME)],
+			),
+		]
+
+	'''
+		Rewrites the main function so that its arguments and local variables live in the frame: local assignments
+		become assignments to frame fields and every reference to them reads the frame. Runs on the Lua AST before the
+		function body is visited, so the IR graph is built from the rewritten statements.
+		Each local gets a field of its own, so a local that shadows another one of the same name is numbered i.e
+		frame.x_2. Loop variables and the arguments and locals of nested functions stay Lua locals, and shadow frame
+		variables of the same name inside their scope.
+	'''
+	def move_locals_to_frame(self, function_node):
+		# Field name to whether it is taken. The names declared in the function are reserved for their first local
+		frame_fields = {}
+		stack = [function_node.body]
+		while stack:
+			lua_node = stack.pop()
+			if isinstance(lua_node, list):
+				stack.extend(lua_node)
+			elif isinstance(lua_node, astnodes.LocalAssign):
+				frame_fields.update((target.id, False) for target in lua_node.targets if isinstance(target, astnodes.Name))
+			elif isinstance(lua_node, astnodes.Node) and not isinstance(lua_node, FUNCTION_NODE_TYPES):
+				stack.extend(value for attr, value in lua_node.__dict__.items() if not attr.startswith('_'))
+
+		renames = {}
+		for arg in function_node.args:
+			if isinstance(arg, astnodes.Name):
+				renames[arg.id] = f"{FRAME_NAME}.{self.allocate_frame_field(arg.id, frame_fields)}"
+		self.rename_variables(function_node.body, renames, frame_fields)
+
+	def allocate_frame_field(self, name, frame_fields):
+		field = name
+		suffix = 1
+		# Numbered fields also skip the names reserved for other locals
+		while frame_fields.get(field, False) or (field != name and field in frame_fields):
+			suffix += 1
+			field = f"{name}_{suffix}"
+		frame_fields[field] = True
+		return field
+
+	'''
+		Renames the variables in renames (name to new name) in a Lua node, following Lua's scoping: a local, loop
+		variable or function argument of the same name shadows a renamed variable until the end of its block.
+		With frame_fields, the locals declared in the node become frame fields, allocated from frame_fields. The locals
+		of nested functions are always left alone. For a block, returns the renames in effect at its end.
+	'''
+	def rename_variables(self, lua_node, renames, frame_fields=None):
+		if isinstance(lua_node, list):
+			# A block: a local is in scope from its declaration to the end of the block
+			for index, item in enumerate(lua_node):
+				if isinstance(item, astnodes.LocalAssign):
+					self.rename_variables(item.values, renames, frame_fields)
+					renames = dict(renames)
+					for target in item.targets:
+						if not isinstance(target, astnodes.Name):
+							continue
+						if frame_fields is None:
+							renames.pop(target.id, None)
+						else:
+							renames[target.id] = target.id = f"{FRAME_NAME}.{self.allocate_frame_field(target.id, frame_fields)}"
+					if frame_fields is not None:
+						# local x, y = a  ->  frame.x, frame.y = a
+						lua_node[index] = astnodes.Assign(targets=item.targets, values=item.values or [astnodes.Nil()])
+				elif isinstance(item, astnodes.LocalFunction):
+					# In scope in its own body, so it can call itself
+					renames = {name: new_name for name, new_name in renames.items() if name != item.name.id}
+					self.rename_variables(item, renames, frame_fields)
+				else:
+					self.rename_variables(item, renames, frame_fields)
+			return renames
+		elif isinstance(lua_node, astnodes.Name):
+			if lua_node.id in renames:
+				lua_node.id = renames[lua_node.id]
+		elif isinstance(lua_node, astnodes.Index):
+			self.rename_variables(lua_node.value, renames, frame_fields)
+			# a.x is a field name, a[x] is a variable
+			if lua_node.notation == astnodes.IndexNotation.SQUARE:
+				self.rename_variables(lua_node.idx, renames, frame_fields)
+		elif isinstance(lua_node, astnodes.Field):
+			if lua_node.between_brackets:
+				self.rename_variables(lua_node.key, renames, frame_fields)
+			self.rename_variables(lua_node.value, renames, frame_fields)
+		elif isinstance(lua_node, astnodes.Invoke):
+			self.rename_variables(lua_node.source, renames, frame_fields)
+			self.rename_variables(lua_node.args, renames, frame_fields)
+		elif isinstance(lua_node, astnodes.Fornum):
+			self.rename_variables([lua_node.start, lua_node.stop, lua_node.step], renames, frame_fields)
+			self.rename_variables(lua_node.body, self.shadow_variables(renames, [lua_node.target]), frame_fields)
+		elif isinstance(lua_node, astnodes.Forin):
+			self.rename_variables(lua_node.iter, renames, frame_fields)
+			self.rename_variables(lua_node.body, self.shadow_variables(renames, lua_node.targets), frame_fields)
+		elif isinstance(lua_node, astnodes.Repeat):
+			# The locals of the body are in scope in the until test
+			body_renames = self.rename_variables(lua_node.body.body, renames, frame_fields)
+			self.rename_variables(lua_node.test, body_renames, frame_fields)
+		elif isinstance(lua_node, FUNCTION_NODE_TYPES):
+			# function x.f() and function x:f() assign to x
+			if isinstance(lua_node, astnodes.Function):
+				self.rename_variables(lua_node.name, renames, frame_fields)
+			elif isinstance(lua_node, astnodes.Method):
+				self.rename_variables(lua_node.source, renames, frame_fields)
+			self.rename_variables(lua_node.body, self.shadow_variables(renames, lua_node.args))
+		elif isinstance(lua_node, astnodes.Node):
+			for attr, value in lua_node.__dict__.items():
+				if not attr.startswith('_'):
+					self.rename_variables(value, renames, frame_fields)
+
+	def shadow_variables(self, renames, names):
+		shadowed = {name.id for name in names if isinstance(name, astnodes.Name)}
+		return {name: new_name for name, new_name in renames.items() if name not in shadowed}
 
 	'''
 	################################################
@@ -616,25 +1821,54 @@ class Translator:
 		Call sorting
 		---------------------------------------------------------------------------------------------------
  	'''
+	'''
+		Visitors are looked up in a table keyed by node class, and the public attributes of each node class (the fields
+		generic_visit walks) in another. Both are filled the first time a class is seen, so visiting does no string
+		work per node. Values that are not nodes (names, numbers, operators) have nothing to visit. Each subclass gets
+		tables of its own, so its visitors do not leak into the tables of its base class or its siblings.
+	'''
+	visitors = {}
+	child_fields = {}
+
+	def __init_subclass__(cls, **kwargs):
+		super().__init_subclass__(**kwargs)
+		cls.visitors = {}
+		cls.child_fields = {}
+
 	def visit(self, node):
-		method = 'visit_' + node.__class__.__name__
-		# get correct visit function
-		visitor = getattr(self, method, self.generic_visit)
-		# call visit function with current node
-		return visitor(node)
+		self.stats.current.nodes_visited += 1
+		visitor = self.visitors.get(node.__class__)
+		if visitor is None:
+			visitor = self.find_visitor(node.__class__)
+		return visitor(self, node)
+
+	@classmethod
+	def find_visitor(cls, node_class):
+		if issubclass(node_class, (astnodes.Node, list)):
+			visitor = getattr(cls, 'visit_' + node_class.__name__, cls.generic_visit)
+		else:
+			visitor = cls.visit_value
+		cls.visitors[node_class] = visitor
+		return visitor
+
+	def visit_list(self, node):
+		for item in node:
+			self.visit(item)
+
+	def visit_value(self, node):
+		pass
 
 	def generic_visit(self, node):
-		if isinstance(node, list):
-			for item in node:
-				self.visit(item)
-		elif isinstance(node, astnodes.Node):
-			logging.debug(f"Generic visit {node._name}")
-			# visit all object public attributes:
-			children = [
-				attr for attr in node.__dict__.keys() if not attr.startswith("_")
-			]
-			for child in children:
-				self.visit(node.__dict__[child])
+		if self.tracer.active:
+			self.tracer.emit("generic_visit", node)
+		node_fields = node.__dict__
+		# The parser sets a few attributes on some instances only, those get their fields from the instance
+		fields, field_count = self.child_fields.get(node.__class__, (None, None))
+		if field_count != len(node_fields):
+			fields = [attr for attr in node_fields if not attr.startswith("_")]
+			self.child_fields[node.__class__] = (fields, len(node_fields))
+		for field in fields:
+			self.visit(node_fields[field])
 
 	'''
 		---------------------------------------------------------------------------------------------------
@@ -702,7 +1936,8 @@ class Translator:
 		---------------------------------------------------------------------------------------------------
  	'''
 	def visit_Function(self, node):
-		logging.debug(f"Visited {node.name.id} with arguments {node.args}")
+		if self.tracer.active:
+			self.tracer.emit("visit_function", node.name.id, node.args)
 		if self.function_count > 0:
 			raise Exception("Error: More than one function defined. Scripts should only contain one function definition.")
 	
@@ -712,6 +1947,9 @@ class Translator:
 
 		# We are now traversing inside the main function
 		self.inside_main_function = True
+
+		if self.frames:
+			self.move_locals_to_frame(node)
   
 		self.IR_graph.add_node(FunctionIRGraphNode(lua_node=node))
 
@@ -723,10 +1961,10 @@ class Translator:
 
 
 	def visit_Call(self, node):
-		logging.debug(f"Visited {node.func.id} with arguments {node.args}")
+		if self.tracer.active:
+			self.tracer.emit("visit_call", node.func.id, node.args)
 		# Find await() calls
 		if node.func.id == 'await':
-			logging.info(f"Await call found. Function: {node.args[0].func.id}")
 			self.IR_graph.add_node(AsyncIRGraphNode(lua_node=node))
 		else:
 			# Regular function call
@@ -752,15 +1990,320 @@ class Translator:
 
 
 
-# Convert the source code to an AST
-source_lua_root_node = ast.parse(cases.source_code_5)
+'''
+################################################
+	BATCH TRANSLATION
+################################################
+'''
 
-#print(ast.to_pretty_str(tree))
-# Create FSM graph
+'''
+	Translates Lua source code. Returns a cache entry: the generated Lua source code, the event table (async link name
+	to the function it resumes), the number of entries in its state tables and the key the entry is cached under.
 
-# Translate
-translator = Translator(source_lua_root_node, render_visual_graph=True)
-translator.translate()
+	The key is a hash of the normalized AST and the translator options. It also seeds the generated names, so a script
+	translates to the same output no matter when, where or alongside which other scripts it is translated, and
+	scripts that only differ in whitespace or comments translate to the same output.
 
+	Trace events of the passes enabled on the tracer are appended to it (cache hits do not run the passes). The
+	TranslationStats of the script are added to the stats log, if given.
+'''
+def translate_script(source, render_visual_graph=False, cache=None, tracer=None, stats=None, **options):
+	if cache is not None:
+		entry = cache.get_source(source, options)
+		if entry is not None:
+			if stats is not None:
+				stats.add(cached_stats(entry))
+			return entry
+
+	source_lua_root_node = ast.parse(source)
+	key = hash_lua_ast(source_lua_root_node, options)
+	if cache is not None:
+		entry = cache.get(key)
+		if entry is not None:
+			cache.put_source(source, key, options)
+			if stats is not None:
+				stats.add(cached_stats(entry))
+			return entry
+
+	translator = Translator(source_lua_root_node, render_visual_graph=render_visual_graph, seed=script_seed(key), tracer=tracer, **options)
+	lua_source = ast.to_lua_source(translator.translate())
+	translator.stats.key = key
+	if stats is not None:
+		stats.add(translator.stats)
+	entry = {
+		'key': key,
+		'lua_source': lua_source,
+		'event_table': translator.construct_event_table(),
+		'state_count': translator.stats.state_count,
+	}
+
+	if cache is not None:
+		cache.put(key, entry)
+		cache.put_source(source, key, options)
+	return entry
 
+'''
+	The seed of a script's translation, taken from its key
+'''
+def script_seed(key):
+	return int(key[:TAG_BITS // 4], 16)
+
+'''
+	Tracks the tags of the scripts of a batch. Scripts with the same tag would overwrite each other's functions and
+	state ranges when loaded together, so a second script with the tag of another is rejected. The same script twice
+	is fine, its definitions are identical.
+'''
+class TagChecker():
+	def __init__(self):
+		self.keys = {}
+
+	def check(self, key):
+		tag = seed_tag(script_seed(key))
+		other_key = self.keys.setdefault(tag, key)
+		if other_key != key:
+			raise Exception(f"Error: Scripts {other_key} and {key} share the tag {tag} and cannot be loaded together.")
+
+'''
+	Stats of a script served from the cache: no pass ran, only what the entry records
+'''
+def cached_stats(entry):
+	stats = TranslationStats(entry['key'], cached=True)
+	stats.state_count = entry['state_count']
+	return stats
+
+'''
+	Translates Lua source code and returns the generated Lua source code
+'''
+def translate_source(source, render_visual_graph=False, cache=None, tracer=None, stats=None, **options):
+	return translate_script(source, render_visual_graph=render_visual_graph, cache=cache, tracer=tracer, stats=stats, **options)['lua_source']
+
+'''
+	Worker side of parallel translation. Stats are returned as a dict so they can be sent back to the parent process.
+'''
+def _translate_script_with_stats(source, **options):
+	stats = StatsLog()
+	entry = translate_script(source, stats=stats, **options)
+	return entry, stats.records[0].to_dict()
+
+'''
+	Translates Lua source code and writes the generated Lua source code to a file-like sink, one top-level statement at
+	a time once the passes have run. Returns the key of the script. With a cache, the translation has to be kept whole
+	to be cached, so it is written at once.
+'''
+def write_script(source, sink, render_visual_graph=False, cache=None, tracer=None, stats=None, **options):
+	if cache is not None:
+		entry = translate_script(source, render_visual_graph=render_visual_graph, cache=cache, tracer=tracer, stats=stats, **options)
+		sink.write(entry['lua_source'])
+		return entry['key']
+
+	source_lua_root_node = ast.parse(source)
+	key = hash_lua_ast(source_lua_root_node, options)
+	translator = Translator(source_lua_root_node, render_visual_graph=render_visual_graph, seed=script_seed(key), tracer=tracer, **options)
+	translator.translate_to(sink)
+	translator.stats.key = key
+	if stats is not None:
+		stats.add(translator.stats)
+	return key
+
+'''
+	Writes the translations of all the given Lua sources to one file-like sink, in order, separated by a blank line.
+	Serial translation writes each script statement by statement; with jobs > 1 each script is written whole as soon
+	as its turn comes.
+'''
+def write_many(sources, sink, render_visual_graph=False, jobs=1, cache=None, tracer=None, stats=None, **options):
+	separator = ''
+	if jobs == 1:
+		tags = TagChecker()
+		for source in sources:
+			sink.write(separator)
+			tags.check(write_script(source, sink, render_visual_graph=render_visual_graph, cache=cache, tracer=tracer, stats=stats, **options))
+			separator = '\n\n'
+		return
+
+	for lua_source in translate_many(sources, render_visual_graph=render_visual_graph, jobs=jobs, cache=cache, stats=stats, **options):
+		sink.write(separator + lua_source)
+		separator = '\n\n'
+
+'''
+	Translates each of the given Lua sources, in order. Yields one generated Lua source per input.
+	With jobs > 1 the sources are translated by a pool of that many worker processes (0 for one per core). The output
+	is identical to translating them serially. Cache lookups and updates happen in this process, only misses are sent
+	to the workers. Tracing needs the passes to run in this process, so a tracer is only used by serial translation.
+	Stats are collected either way, one record per source in input order.
+'''
+def translate_many(sources, render_visual_graph=False, jobs=1, cache=None, tracer=None, stats=None, **options):
+	tags = TagChecker()
+	if jobs == 1:
+		for source in sources:
+			entry = translate_script(source, render_visual_graph=render_visual_graph, cache=cache, tracer=tracer, stats=stats, **options)
+			tags.check(entry['key'])
+			yield entry['lua_source']
+		return
+
+	sources = list(sources)
+	entries = [None] * len(sources)
+	script_stats = [None] * len(sources)
+	if cache is not None:
+		for index, source in enumerate(sources):
+			entries[index] = cache.get_source(source, options)
+			if entries[index] is None:
+				# Sources that only differ in whitespace or comments share the key of their normalized AST
+				key = hash_lua_ast(ast.parse(source), options)
+				entries[index] = cache.get(key)
+				if entries[index] is not None:
+					cache.put_source(source, key, options)
+			if entries[index] is not None:
+				script_stats[index] = cached_stats(entries[index])
+	missed = [index for index, entry in enumerate(entries) if entry is None]
+
+	from concurrent.futures import ProcessPoolExecutor
+	with ProcessPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+		translate = partial(_translate_script_with_stats, render_visual_graph=render_visual_graph, **options)
+		for index, (entry, stats_dict) in zip(missed, executor.map(translate, [sources[index] for index in missed], chunksize=8)):
+			entries[index] = entry
+			script_stats[index] = TranslationStats.from_dict(stats_dict)
+			if cache is not None:
+				cache.put(entry['key'], entry)
+				cache.put_source(sources[index], entry['key'], options)
+
+	for entry, translation_stats in zip(entries, script_stats):
+		tags.check(entry['key'])
+		if stats is not None:
+			stats.add(translation_stats)
+		yield entry['lua_source']
 
+'''
+	Yields (name, source) pairs for every .lua file in a directory
+'''
+def read_lua_directory(directory):
+	for file_name in sorted(os.listdir(directory)):
+		if file_name.endswith('.lua'):
+			with open(os.path.join(directory, file_name)) as lua_file:
+				yield os.path.splitext(file_name)[0], lua_file.read()
+
+'''
+	Yields (name, source) pairs from a stream of JSON lines of the form {"name": ..., "source": ...}
+'''
+def read_lua_stream(stream):
+	for line in stream:
+		if line.strip():
+			script = json.loads(line)
+			yield script['name'], script['source']
+
+'''
+	Installs colored log output. Importing the translator leaves logging alone; only the command-line driver sets it up.
+'''
+def setup_logging(level='INFO'):
+	import coloredlogs
+	os.environ["COLOREDLOGS_LOG_FORMAT"] ='[%(hostname)s] %(funcName)s :: %(levelname)s :: %(message)s'
+	coloredlogs.install(level=level)
+
+'''
+	Opens an output file for writing. The output goes to a temporary file next to it, which replaces the file once
+	everything is written, so a translation that fails partway leaves no truncated file behind.
+'''
+@contextmanager
+def open_output(path):
+	tmp_path = f"{path}.{os.getpid()}.tmp"
+	try:
+		with open(tmp_path, 'w') as output_file:
+			yield output_file
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+'''
+	Writes the stats log as JSON lines to a file, or to stdout for -
+'''
+def write_stats(stats, path, names):
+	if stats is None:
+		return
+	if path == '-':
+		stats.dump_json(sys.stdout, names)
+	else:
+		with open(path, 'w') as stats_file:
+			stats.dump_json(stats_file, names)
+
+def main(argv=None):
+	import argparse
+	parser = argparse.ArgumentParser(description="Translate Lua scripts to event-driven finite state machines")
+	parser.add_argument('input', help="Directory of .lua files, or - to read JSON lines ({\"name\": ..., \"source\": ...}) from stdin")
+	parser.add_argument('-o', '--output', default='out', help="Directory the translated scripts are written to")
+	parser.add_argument('--bundle', help="Write all translated scripts to this one file instead of one file per script")
+	parser.add_argument('--event-mode', choices=EVENT_MODES, default='events', help="One custom event per await, or one shared dispatcher")
+	parser.add_argument('--state-ids', choices=STATE_ID_MODES, default='names', help="Key the event tables by link name, or by small integers")
+	parser.add_argument('--frames', action='store_true', help="Keep the locals and program counter of each invocation in its own frame")
+	parser.add_argument('--tick-budget', type=int, help="Cut the generated code into slices of about this many work units per tick, resumed from on_tick (needs --frames)")
+	parser.add_argument('--render-visual-graph', action='store_true', help="Render the IR graphs of each script with graphviz")
+	parser.add_argument('-j', '--jobs', type=int, default=1, help="Number of worker processes (0 for one per core)")
+	parser.add_argument('--cache-dir', help="Directory of cached translations, reused across runs")
+	parser.add_argument('--log-level', default='INFO', help="Log level, e.g. DEBUG")
+	parser.add_argument('--stats', help="Write the per pass stats of each script to this file as JSON lines (- for stdout)")
+	parser.add_argument('--trace', help="Comma separated passes to trace, or 'all'. Events are written to stderr, translation runs serially")
+	args = parser.parse_args(argv)
+
+	setup_logging(args.log_level)
+
+	cache = TranslationCache(cache_dir=args.cache_dir) if args.cache_dir else None
+	tracer = None
+	if args.trace:
+		tracer = Tracer(args.trace.split(','))
+		args.jobs = 1
+	stats = StatsLog() if args.stats else None
+
+	# Translator options, left out at their defaults so they do not change cache keys
+	options = {}
+	if args.event_mode != 'events':
+		options['event_mode'] = args.event_mode
+	if args.state_ids != 'names':
+		options['state_ids'] = args.state_ids
+	if args.frames:
+		options['frames'] = True
+	if args.tick_budget is not None:
+		options['tick_budget'] = args.tick_budget
+
+	scripts = read_lua_stream(sys.stdin) if args.input == '-' else read_lua_directory(args.input)
+
+	# Names are collected as the sources are consumed
+	names = []
+	def sources():
+		for name, source in scripts:
+			names.append(name)
+			yield source
+
+	if args.bundle:
+		with open_output(args.bundle) as bundle_file:
+			write_many(sources(), bundle_file, render_visual_graph=args.render_visual_graph, jobs=args.jobs, cache=cache, tracer=tracer, stats=stats, **options)
+		logging.info(f"Translated {len(names)} scripts to {args.bundle}")
+		if tracer is not None:
+			tracer.dump()
+		write_stats(stats, args.stats, names)
+		return
+
+	os.makedirs(args.output, exist_ok=True)
+	if args.jobs == 1:
+		# Each script is written to its file statement by statement
+		tags = TagChecker()
+		for name, source in scripts:
+			names.append(name)
+			with open_output(os.path.join(args.output, name + '.lua')) as lua_file:
+				tags.check(write_script(source, lua_file, render_visual_graph=args.render_visual_graph, cache=cache, tracer=tracer, stats=stats, **options))
+			logging.info(f"Translated {name}")
+			if tracer is not None:
+				tracer.dump()
+				tracer.clear()
+	else:
+		lua_sources = translate_many(sources(), render_visual_graph=args.render_visual_graph, jobs=args.jobs, cache=cache, stats=stats, **options)
+		for index, lua_source in enumerate(lua_sources):
+			name = names[index]
+			with open_output(os.path.join(args.output, name + '.lua')) as lua_file:
+				lua_file.write(lua_source)
+			logging.info(f"Translated {name}")
+
+	write_stats(stats, args.stats, names)
+
+
+if __name__ == '__main__':
+	main()
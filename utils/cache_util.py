@@ -0,0 +1,176 @@
+"""
+    Content-addressed cache of translations.
+    Keyed on a hash of the normalized Lua AST and the translator options.
+"""
+
+import enum
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+from luaparser import astnodes
+
+
+# Bump when the generated code changes so stale on-disk entries are not reused
+CACHE_VERSION = 15
+
+# Attributes that do not change what a script does: comments and string quoting
+IGNORED_ATTRIBUTES = {'comments', 'delimiter'}
+
+
+'''
+    Hashes a Lua AST, ignoring comments, whitespace (token positions are not part of the hash) and string quoting.
+    Scripts that only differ in those hash the same.
+'''
+
+
+def hash_lua_ast(lua_root_node, options=None):
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}|{sorted((options or {}).items())!r}|".encode())
+
+    stack = [lua_root_node]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, astnodes.Node):
+            digest.update(b'(' + type(value).__name__.encode())
+            stack.append(_END_NODE)
+            fields = [(attr, attr_value) for attr, attr_value in value.__dict__.items()
+                      if not attr.startswith('_') and attr not in IGNORED_ATTRIBUTES]
+            for attr, attr_value in reversed(fields):
+                stack.append(attr_value)
+                stack.append(_Field(attr))
+        elif isinstance(value, list):
+            digest.update(b'[')
+            stack.append(_END_LIST)
+            stack.extend(reversed(value))
+        elif isinstance(value, _Field):
+            digest.update(b' ' + value.name.encode() + b'=')
+        elif value is _END_NODE:
+            digest.update(b')')
+        elif value is _END_LIST:
+            digest.update(b']')
+        elif isinstance(value, enum.Enum):
+            digest.update(value.name.encode())
+        else:
+            digest.update(repr(value).encode() + b',')
+
+    return digest.hexdigest()
+
+
+class _Field():
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+
+_END_NODE = object()
+_END_LIST = object()
+
+
+def hash_source(source, options=None):
+    return hashlib.sha256(f"{sorted((options or {}).items())!r}|".encode() + source.encode()).hexdigest()
+
+
+'''
+    LRU cache of translation entries (JSON-serializable dicts), optionally backed by a directory with one JSON file per
+    entry. Exact source text is also mapped to its AST key, so resubmitting a script byte for byte skips parsing.
+    The directory holds at most max_disk_entries entries: reads refresh an entry's modification time, and once the
+    directory is full the least recently used tenth is removed. Entries that cannot be read or decoded are misses.
+'''
+
+
+class TranslationCache():
+    def __init__(self, max_entries=1024, cache_dir=None, max_disk_entries=65536):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.disk_entry_count = 0
+
+        self.entries = OrderedDict()
+        self.source_keys = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            self.disk_entry_count = len(self._disk_entries())
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _remember(self, table, key, value):
+        table[key] = value
+        table.move_to_end(key)
+        if len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _disk_entries(self):
+        return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+
+    def _read_disk_entry(self, key):
+        try:
+            with open(self._entry_path(key)) as entry_file:
+                entry = json.load(entry_file)
+            os.utime(self._entry_path(key))
+            return entry
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # Corrupt or unreadable, translated again and overwritten
+            return None
+
+    def _evict_disk_entries(self):
+        disk_entries = self._disk_entries()
+        if len(disk_entries) > self.max_disk_entries:
+            disk_entries.sort(key=lambda entry: entry.stat().st_mtime)
+            for entry in disk_entries[:len(disk_entries) - self.max_disk_entries + self.max_disk_entries // 10]:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        self.disk_entry_count = len(self._disk_entries())
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        if self.cache_dir is not None:
+            entry = self._read_disk_entry(key)
+            if entry is not None:
+                self._remember(self.entries, key, entry)
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        self._remember(self.entries, key, entry)
+
+        if self.cache_dir is not None:
+            # Write then rename so readers never see a partial entry
+            tmp_path = self._entry_path(key) + f'.{os.getpid()}.tmp'
+            with open(tmp_path, 'w') as entry_file:
+                json.dump(entry, entry_file)
+            os.replace(tmp_path, self._entry_path(key))
+            self.disk_entry_count += 1
+            if self.disk_entry_count > self.max_disk_entries:
+                self._evict_disk_entries()
+
+    def get_source(self, source, options=None):
+        key = self.source_keys.get(hash_source(source, options))
+        if key is None:
+            return None
+        return self.get(key)
+
+    def put_source(self, source, key, options=None):
+        self._remember(self.source_keys, hash_source(source, options), key)
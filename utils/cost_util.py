@@ -0,0 +1,34 @@
+"""
+    Cost estimates of Lua statements, in abstract work units, used to cut generated code into slices that fit a
+    per-tick work budget.
+"""
+
+from luaparser import astnodes
+
+
+# Every node of a statement's AST costs one unit. A call costs more, the callee does work the estimate cannot see.
+NODE_COST = 1
+CALL_COST = 10
+
+
+'''
+    Estimated cost of running a Lua node once. Bodies of anonymous functions are not run where they are defined, so
+    only the definition is counted.
+'''
+
+
+def estimate_cost(lua_node):
+    cost = 0
+    stack = [lua_node]
+    while stack:
+        lua_node = stack.pop()
+        if isinstance(lua_node, list):
+            stack.extend(lua_node)
+        elif isinstance(lua_node, astnodes.Node):
+            cost += NODE_COST
+            if isinstance(lua_node, (astnodes.Call, astnodes.Invoke)):
+                cost += CALL_COST
+            if isinstance(lua_node, astnodes.AnonymousFunction):
+                continue
+            stack.extend(value for attr, value in lua_node.__dict__.items() if not attr.startswith('_') and attr != 'comments')
+    return cost
@@ -1,7 +1,6 @@
 
 import os
 from IR_nodes import *
-from graphviz import Digraph
 
 
 '''
@@ -10,6 +9,11 @@ from graphviz import Digraph
 
 
 def render_visual_graph(output_graph_name, root_nodes):
+    # graphviz is only needed (and only imported) when rendering
+    # windows only
+    if os.name == 'nt' and 'Graphviz' not in os.environ["PATH"]:
+        os.environ["PATH"] += os.pathsep + 'C:/Program Files/Graphviz/bin/'
+    from graphviz import Digraph
 
     visual_graph = Digraph()
 
@@ -45,50 +49,18 @@ def _render_visual_graph(visual_graph, node):
 
 
 '''
-	Creates a deep copy of the entire tree under src_node and places it under the dst_node of the dst_graph
+	Moves the entire tree under src_node from its parent to the dst_node of the dst_graph without copying it.
+	Returns the moved nodes.
 '''
 
 
-def copy_tree(src_node, dst_graph, dst_node):
-    dst_graph.pointer = dst_node
-    _copy_tree(dst_graph, src_node)
+def move_tree(src_node, dst_graph, dst_node):
+    if src_node.parent is not None:
+        src_node.parent.remove_child(src_node)
+    dst_node.add_child(src_node)
 
+    moved_nodes = list(dst_graph.preorder(src_node))
+    for node in moved_nodes:
+        node.IR_graph = dst_graph
 
-def _copy_tree(dst_graph, node):
-    copied_node = copy.copy(node)
-    dst_graph.add_node(copied_node)
-
-    if len(node.children) > 1:
-        for child in node.children:
-            dst_graph.pointer = copied_node
-            _copy_tree(dst_graph, child)
-    elif len(node.children) == 1:
-        _copy_tree(dst_graph, node.children[0])
-
-
-def remove_duplicates(l):
-    return list(set(l))
-
-
-'''
-	Returns the leaf nodes of a graph, including those inside subgraph links. Removes duplicates.
-'''
-
-
-def get_subgraph_leaf_nodes(node):
-    leaves = []
-    _get_subgraph_leaf_nodes(node, leaves)
-    return remove_duplicates(leaves)
-
-
-def _get_subgraph_leaf_nodes(node, leaves):
-    if not node.children:
-        leaves.append(node)
-        return
-
-    for child in node.children:
-        # Enter subgraphs
-        if isinstance(child, GeneratedLinkIRGraphNode):
-            _get_subgraph_leaf_nodes(child.linked_graph.root_node, leaves)
-        else:
-            _get_subgraph_leaf_nodes(child, leaves)
+    return moved_nodes
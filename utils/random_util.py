@@ -3,9 +3,18 @@
     Seeded for reproducability
 """
 
+import itertools
 import random
 import string
-import uuid
+
+
+# Translations are seeded with 64 bits of their key, written out in full as the tag: scripts loaded together only
+# share a tag (and overwrite each other's functions and state ranges) with odds of about n^2 / 2^65
+TAG_BITS = 64
+
+
+def seed_tag(seed):
+    return f"{seed % (1 << TAG_BITS):0{TAG_BITS // 4}x}"
 
 
 class RandomUtil():
@@ -13,31 +22,29 @@ class RandomUtil():
         self.seed = seed
 
         self.rnd = random.Random()
-        # NOTE: Of course don't use a static seed in production
-        self.rnd.seed(123)
+        self.rnd.seed(seed)
 
-        # I can't imagine ever having a collision but ig this doesn't hurt
-        self.function_names = []
+        # Names are <prefix>_<tag>_<counter>. The counter makes them unique within a translation, and the tag (the
+        # seed itself) keeps apart the names of scripts that are loaded into the same game
+        self.tag = seed_tag(seed)
+        self.name_counter = itertools.count()
 
-    def generate_function_name(self):
-        func_name = ''
-        while func_name not in self.function_names:
-            uuid_str = str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
-            func_name = 'func_' + uuid_str
-            self.function_names.append(func_name)
+        self.node_ids = itertools.count()
 
-        return func_name
+    def generate_name(self, prefix):
+        # Names are Lua identifiers, counters are written in base 16 to keep them short
+        return f"{prefix}_{self.tag}_{next(self.name_counter):x}"
 
-    def generate_link_name(self):
-        func_name = ''
-        while func_name not in self.function_names:
-            uuid_str = str(uuid.UUID(int=self.rnd.getrandbits(128), version=4))
-            func_name = 'link_' + uuid_str
-            self.function_names.append(func_name)
+    def generate_function_name(self):
+        return self.generate_name('f')
 
-        return func_name
+    def generate_link_name(self):
+        return self.generate_name('l')
 
     def generate_id(self):
         id_length = 6
         characters = string.ascii_lowercase + string.ascii_uppercase + string.digits
         return ''.join(self.rnd.choices(characters, k=id_length))
+
+    def generate_node_id(self):
+        return next(self.node_ids)
@@ -0,0 +1,137 @@
+"""
+    Per-pass statistics of a translation.
+    Counters are plain integer attributes, bumped by the passes and cheap enough to always be collected.
+"""
+
+import json
+import sys
+import time
+
+
+'''
+    Wall time and counters of one pass. nodes_visited counts the IR nodes (or Lua nodes, for the build pass) the pass
+    walked over, nodes_moved counts the IR nodes moved to another graph, graphs_created and links_created count the
+    execution graphs and link nodes the pass added, and graphs_merged the graphs it merged into identical ones.
+'''
+
+
+class PassStats():
+    __slots__ = ('name', 'wall_time', 'nodes_visited', 'nodes_moved', 'graphs_created',
+                 'links_created', 'graphs_merged')
+
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.nodes_visited = 0
+        self.nodes_moved = 0
+        self.graphs_created = 0
+        self.links_created = 0
+        self.graphs_merged = 0
+
+    def to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+
+'''
+    Stats of every pass of a translation, in the order they ran. The translator calls begin() at the start of each pass
+    and end() after the last one; the counters of the current pass are bumped through current.
+'''
+
+
+class TranslationStats():
+    def __init__(self, key=None, cached=False):
+        self.key = key
+        # Served from the cache, no pass ran
+        self.cached = cached
+        # Entries of the generated state tables (one per async link)
+        self.state_count = 0
+        self.passes = []
+        self.current = None
+
+        self._pass_start = None
+
+    def begin(self, pass_name):
+        self.end()
+        self.current = PassStats(pass_name)
+        self.passes.append(self.current)
+        self._pass_start = time.perf_counter()
+
+    def end(self):
+        if self.current is not None:
+            self.current.wall_time += time.perf_counter() - self._pass_start
+        self.current = None
+
+    def __getitem__(self, pass_name):
+        for pass_stats in self.passes:
+            if pass_stats.name == pass_name:
+                return pass_stats
+        raise KeyError(pass_name)
+
+    @property
+    def wall_time(self):
+        return sum(pass_stats.wall_time for pass_stats in self.passes)
+
+    def total(self, counter):
+        return sum(getattr(pass_stats, counter) for pass_stats in self.passes)
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'cached': self.cached,
+            'state_count': self.state_count,
+            'wall_time': self.wall_time,
+            'passes': [pass_stats.to_dict() for pass_stats in self.passes],
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_dict(cls, stats_dict):
+        stats = cls(stats_dict['key'], stats_dict['cached'])
+        stats.state_count = stats_dict['state_count']
+        for pass_dict in stats_dict['passes']:
+            pass_stats = PassStats(pass_dict['name'])
+            for attr, value in pass_dict.items():
+                # Counters dropped since the stats were written are skipped
+                if attr in PassStats.__slots__:
+                    setattr(pass_stats, attr, value)
+            stats.passes.append(pass_stats)
+        return stats
+
+    def format(self):
+        lines = [f"{'pass':<16}{'ms':>10}{'visited':>10}{'moved':>10}{'graphs':>10}{'links':>10}"]
+        for pass_stats in self.passes:
+            lines.append(
+                f"{pass_stats.name:<16}{pass_stats.wall_time * 1000:>10.3f}{pass_stats.nodes_visited:>10}"
+                f"{pass_stats.nodes_moved:>10}{pass_stats.graphs_created:>10}{pass_stats.links_created:>10}"
+            )
+        return '\n'.join(lines)
+
+
+'''
+    Collects the stats of the scripts given to translate_script/translate_many, one record per script in input order.
+    Scripts served from the cache do not run the passes, their record is marked cached and has no passes.
+'''
+
+
+class StatsLog():
+    def __init__(self):
+        self.records = []
+
+    def add(self, stats):
+        self.records.append(stats)
+
+    def clear(self):
+        self.records = []
+
+    '''
+        Writes one JSON object per script: {"name": ..., "key": ..., "cached": ..., "state_count": ..., "wall_time": ..., "passes": [...]}
+        Names default to the index of the script.
+    '''
+
+    def dump_json(self, stream=None, names=None):
+        stream = stream or sys.stdout
+        for index, stats in enumerate(self.records):
+            name = names[index] if names is not None else index
+            stream.write(json.dumps({'name': name, **stats.to_dict()}) + '\n')
@@ -0,0 +1,62 @@
+"""
+    Structured tracing for the translator passes.
+    Events are buffered as (pass, event, args) tuples and only formatted when dumped.
+"""
+
+import sys
+
+
+ALL_PASSES = ('build', 'expand', 'linearize', 'separate_async', 'slice', 'event_pointers', 'dedupe', 'construct_ast')
+
+
+'''
+    Tracing is enabled per pass. The translator calls begin() at the start of each pass, which sets active, and every
+    call site checks active before emitting, so a disabled trace costs one attribute check and builds no strings.
+'''
+
+
+class Tracer():
+    def __init__(self, passes=()):
+        # A single pass can be given as a string. 'all' (alone or as one of the passes) enables every pass
+        if isinstance(passes, str):
+            passes = (passes,)
+        unknown_passes = set(passes) - set(ALL_PASSES) - {'all'}
+        if unknown_passes:
+            raise Exception(f"Error: Unknown passes {sorted(unknown_passes)}, expected some of {ALL_PASSES}.")
+        self.passes = frozenset(ALL_PASSES if 'all' in passes else passes)
+        self.events = []
+
+        self.pass_name = None
+        self.active = False
+
+    def begin(self, pass_name):
+        self.pass_name = pass_name
+        self.active = pass_name in self.passes
+
+    def emit(self, event, *args):
+        self.events.append((self.pass_name, event, args))
+
+    def clear(self):
+        self.events = []
+
+    def format_event(self, event):
+        pass_name, event_name, args = event
+        return f"[{pass_name}] {event_name} " + ' '.join(_format_arg(arg) for arg in args)
+
+    def dump(self, stream=None):
+        stream = stream or sys.stderr
+        for event in self.events:
+            stream.write(self.format_event(event) + '\n')
+
+
+def _format_arg(arg):
+    # IR nodes
+    if hasattr(arg, 'children') and hasattr(arg, 'id'):
+        return f"{arg.name}#{arg.id}"
+    # IR graphs
+    if hasattr(arg, 'generated_name'):
+        return arg.generated_name
+    # Lua nodes
+    if hasattr(arg, '_name'):
+        return arg._name
+    return str(arg)